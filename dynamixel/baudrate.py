@@ -0,0 +1,158 @@
+"""Moves every servo on a bus to a new baud rate in one go.
+
+    baudrate.change_bus_baud(bus, 1000000)
+
+The servos are found at the current baud rate, told to switch (with one
+broadcast write if they are all the same model), the UART is switched over
+and every servo is checked at the new rate. If any servo is lost, the ones
+that did move are sent back and the UART is restored, so the bus is never
+left half switched."""
+import logging
+import time
+
+from . import protocol2, servodata
+
+LOGGER = logging.getLogger(__name__)
+
+BAUD_RATE = 'Baud Rate'
+TORQUE_ENABLE = 'Torque Enable'
+# How long to give servos to switch baud rate after being told to
+SETTLE_TIME = 0.05
+
+
+def _register(descriptor, name):
+    register = servodata.find_register(descriptor, name)
+    if register is None:
+        raise ValueError("{} has no {} register".format(
+            descriptor['name'], name
+        ))
+    return register
+
+
+def _find_servos(bus, addresses):
+    if addresses is None:
+        return bus.broadcast_ping()
+    found = {}
+    for address in addresses:
+        model_number = bus.ping(address)
+        if model_number is not None:
+            found[address] = model_number
+    return found
+
+
+def _write_baud(bus, servos, baud_rate, broadcast):
+    """Tells servos to switch baud rate, without waiting for replies (they
+    may arrive at either rate). servos maps address to descriptor. If
+    broadcast is set and the servos are all the same model, a single
+    broadcast write is used"""
+    models = {descriptor['model_number'] for descriptor in servos.values()}
+    if broadcast and len(models) == 1 and len(servos) > 1:
+        descriptor = list(servos.values())[0]
+        register = _register(descriptor, BAUD_RATE)
+        value = servodata.baud_rate_value(descriptor, baud_rate)
+        LOGGER.info("Broadcasting baud rate %d", baud_rate)
+        bus.send_blind(protocol2.BROADCAST_ADDRESS, protocol2.WRITE, [
+            register['address'] % 256, register['address'] >> 8, value
+        ])
+        return
+    for address, descriptor in servos.items():
+        register = _register(descriptor, BAUD_RATE)
+        value = servodata.baud_rate_value(descriptor, baud_rate)
+        LOGGER.info("Setting servo %d to baud rate %d", address, baud_rate)
+        bus.send_blind(address, protocol2.WRITE, [
+            register['address'] % 256, register['address'] >> 8, value
+        ])
+        # Let the servo's reply (if any) go past before the next write
+        bus.wait_for_idle()
+
+
+def _set_uart_baud(bus, baud_rate, settle_time):
+    time.sleep(settle_time)
+    bus.uart.baudrate = baud_rate
+    bus.uart.reset_input_buffer()
+
+
+def _missing(bus, servos):
+    return [address for address in servos if bus.ping(address) is None]
+
+
+def change_bus_baud(bus, baud_rate, addresses=None, disable_torque=False,
+                    settle_time=SETTLE_TIME):
+    """Switches every servo on a bus (or just those at addresses) and the
+    bus's UART to baud_rate. The Baud Rate register can only be written
+    with the torque off: if any servo has its torque on, this fails unless
+    disable_torque is set, in which case the torque is switched off for the
+    change and back on afterwards.
+
+    Returns True if every servo was found at the new baud rate. Otherwise
+    the change is rolled back and False is returned. Raises ValueError
+    (before changing anything) if a servo can't use baud_rate"""
+    old_baud = bus.uart.baudrate
+    found = _find_servos(bus, addresses)
+    if not found:
+        LOGGER.error("No servos found at baud rate %d", old_baud)
+        return False
+
+    servos = {}
+    for address, model_number in sorted(found.items()):
+        descriptor = servodata.get_servo(model_number)
+        if descriptor is None:
+            raise ValueError("Servo {} is an unknown model ({})".format(
+                address, model_number
+            ))
+        _register(descriptor, BAUD_RATE)
+        for rate in (baud_rate, old_baud):
+            if servodata.baud_rate_value(descriptor, rate) is None:
+                raise ValueError("{} (servo {}) can't use baud rate {}".format(
+                    descriptor['name'], address, rate
+                ))
+        servos[address] = descriptor
+    if baud_rate == old_baud:
+        return True
+
+    torque_on = []
+    for address, descriptor in servos.items():
+        torque = servodata.find_register(descriptor, TORQUE_ENABLE)
+        if torque is None:
+            continue
+        data = bus.read(address, torque['address'], 1)
+        if data is None or data[1]:
+            torque_on.append(address)
+    if torque_on and not disable_torque:
+        LOGGER.error(
+            "Servos %s have torque enabled, not changing baud rate", torque_on
+        )
+        return False
+    for address in torque_on:
+        torque = _register(servos[address], TORQUE_ENABLE)
+        if bus.write(address, torque['address'], [0]) is None:
+            LOGGER.error("Failed to disable torque on servo %d", address)
+            return False
+
+    _write_baud(bus, servos, baud_rate, addresses is None)
+    _set_uart_baud(bus, baud_rate, settle_time)
+    missing = _missing(bus, servos)
+    success = not missing
+
+    if missing:
+        LOGGER.error(
+            "Servos %s lost at baud rate %d, rolling back", missing, baud_rate
+        )
+        moved = {
+            address: descriptor for address, descriptor in servos.items()
+            if address not in missing
+        }
+        # Only the servos that moved can hear the new baud rate
+        _write_baud(bus, moved, old_baud, True)
+        _set_uart_baud(bus, old_baud, settle_time)
+        still_missing = _missing(bus, servos)
+        if still_missing:
+            LOGGER.error(
+                "Servos %s did not come back at baud rate %d",
+                still_missing, old_baud
+            )
+
+    for address in torque_on:
+        torque = _register(servos[address], TORQUE_ENABLE)
+        bus.write(address, torque['address'], [1])
+    return success
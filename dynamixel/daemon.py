@@ -0,0 +1,462 @@
+"""Lets several processes use the servos on one serial port.
+
+A BusDaemon owns the Protocol2Bus and runs the read/write cycle on a
+BusScheduler. After every cycle it publishes each servo's control table into
+a block of shared memory. Other processes connect with a DaemonClient, which
+gives them a Servo-like proxy per servo: get_* functions decode straight out
+of shared memory (no round trip to the daemon), while set_* functions send
+a request over a local unix socket.
+
+Shared memory layout (all little endian):
+
+    header:  magic "DXL2", version, slot count, table size    (4 x u32)
+    slots:   sequence (u32), address (u16), model number (u16),
+             sample time in ns (u64), control table (table size bytes)
+
+Each slot is protected by a seqlock: the daemon makes the sequence number
+odd while it is writing the slot and even again once it is done. A reader
+copies the slot and retries if the sequence number was odd or changed while
+it was copying, so readers never block the daemon."""
+import functools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from . import provision, scheduler, servo, servodata, writebuffer
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'DXL2'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+SLOT_HEADER = struct.Struct('<IHHQ')
+SEQUENCE = struct.Struct('<I')
+MAX_READ_ATTEMPTS = 1000
+# Seconds a client request waits for the bus before giving up
+REQUEST_TIMEOUT = 1.0
+
+# Names of the shared memory blocks created by this process
+_CREATED = set()
+
+# The registers refreshed on every cycle (the span covering all of them is
+# read as one block). Everything else is refreshed a servo at a time when
+# there is slack in the cycle
+STATE_REGISTERS = [
+    'Goal Position', 'Present Position', 'Present Speed', 'Present Load',
+    'Present Voltage', 'Present Temperature', 'Moving',
+    'Hardware Error Status',
+]
+
+
+def default_socket_path(port):
+    """Returns the socket a daemon for a serial port listens on by default"""
+    return '/tmp/dynamixel-{}.sock'.format(os.path.basename(port))
+
+
+def slot_size(table_size):
+    """Returns the size of a shared memory slot holding a control table"""
+    size = SLOT_HEADER.size + table_size
+    return size + (-size % 8)  # Keep the timestamps aligned
+
+
+class StateBlock:
+    """The shared memory that holds the latest control table of every
+    servo. The daemon creates it with create(), clients use attach()"""
+    def __init__(self, shm, slot_count, table_size):
+        self.shm = shm
+        self.slot_count = slot_count
+        self.table_size = table_size
+        self.slot_size = slot_size(table_size)
+        self.buffer = shm.buf
+
+    @classmethod
+    def create(cls, name, slot_count, table_size):
+        """Creates a new block of shared memory"""
+        shm = shared_memory.SharedMemory(
+            name=name, create=True,
+            size=HEADER.size + slot_size(table_size) * slot_count
+        )
+        _CREATED.add(name)
+        block = cls(shm, slot_count, table_size)
+        HEADER.pack_into(block.buffer, 0, MAGIC, VERSION, slot_count, table_size)
+        for slot in range(slot_count):
+            SLOT_HEADER.pack_into(block.buffer, block._offset(slot), 0, 0, 0, 0)
+        return block
+
+    @classmethod
+    def attach(cls, name):
+        """Opens a block created by another process"""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before python 3.13 every process that opens shared memory
+            # tries to delete it on exit. Only the daemon should.
+            shm = shared_memory.SharedMemory(name=name)
+            if name not in _CREATED:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        magic, version, slot_count, table_size = HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            shm.close()
+            raise ValueError("{} is not a dynamixel state block".format(name))
+        return cls(shm, slot_count, table_size)
+
+    def _offset(self, slot):
+        return HEADER.size + slot * self.slot_size
+
+    def publish(self, slot, address, model_number, register, data,
+                stamp_ns=None):
+        """Copies data into the control table of a slot, starting at
+        register. Only the daemon may call this"""
+        if stamp_ns is None:
+            stamp_ns = time.monotonic_ns()
+        offset = self._offset(slot)
+        sequence = SEQUENCE.unpack_from(self.buffer, offset)[0]
+        SEQUENCE.pack_into(self.buffer, offset, (sequence + 1) & 0xFFFFFFFF)
+        SLOT_HEADER.pack_into(
+            self.buffer, offset, (sequence + 1) & 0xFFFFFFFF,
+            address, model_number, stamp_ns
+        )
+        start = offset + SLOT_HEADER.size + register
+        self.buffer[start:start + len(data)] = data
+        SEQUENCE.pack_into(self.buffer, offset, (sequence + 2) & 0xFFFFFFFF)
+
+    def snapshot(self, slot):
+        """Returns a consistent copy of a slot as (address, model_number,
+        stamp_ns, control_table)"""
+        offset = self._offset(slot)
+        end = offset + self.slot_size
+        for _ in range(MAX_READ_ATTEMPTS):
+            before = SEQUENCE.unpack_from(self.buffer, offset)[0]
+            if before % 2:
+                continue
+            copy = bytes(self.buffer[offset:end])
+            if SEQUENCE.unpack_from(self.buffer, offset)[0] == before:
+                _, address, model_number, stamp_ns = \
+                    SLOT_HEADER.unpack_from(copy, 0)
+                return (
+                    address, model_number, stamp_ns,
+                    copy[SLOT_HEADER.size:SLOT_HEADER.size + self.table_size]
+                )
+        raise RuntimeError("Could not get a consistent read of the state")
+
+    def close(self):
+        self.buffer = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+        _CREATED.discard(self.shm.name)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handles a client connection: one json request per line, one json
+    reply per line"""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.daemon.handle_request(json.loads(line))
+            except Exception as err:  # Report the problem, keep serving
+                LOGGER.exception("Bad request %s", line)
+                reply = {'ok': False, 'error': str(err)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class _SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class BusDaemon:
+    """Owns a bus and shares it with other processes. See the module
+    docstring. The servos are found with a broadcast ping when the daemon
+    starts unless a list of addresses is given. Requests that need the bus
+    fail if they haven't been done within request_timeout seconds"""
+    def __init__(self, bus, socket_path, shm_name=None, cycle_time=0.01,
+                 addresses=None, state_registers=None,
+                 request_timeout=REQUEST_TIMEOUT):
+        self.bus = bus
+        self.request_timeout = request_timeout
+        self.socket_path = socket_path
+        self.shm_name = shm_name or 'dynamixel-{}'.format(
+            os.path.basename(socket_path).split('.')[0]
+        )
+        self.addresses = addresses
+        self.state_registers = state_registers or STATE_REGISTERS
+        self.scheduler = scheduler.BusScheduler(bus, cycle_time)
+        self.state = None
+        self.slots = {}
+        self.models = {}
+        self.write_buffer = writebuffer.WriteBuffer(bus)
+        self._commands = queue.Queue()
+        self._stopped = False
+        self._server = None
+        self._server_thread = None
+
+    def start(self):
+        """Finds the servos, sets up the shared memory and starts serving
+        clients and running the bus cycle in background threads"""
+        dump = provision.dump_control_tables(self.bus, self.addresses)
+        table_size = max(
+            [len(entry['control_table']) for entry in dump.values()] + [1]
+        )
+        self.state = StateBlock.create(self.shm_name, len(dump), table_size)
+        for slot, (address, entry) in enumerate(sorted(dump.items())):
+            self.slots[address] = slot
+            self.models[address] = entry['model_number']
+            self.state.publish(
+                slot, address, entry['model_number'], 0,
+                entry['control_table']
+            )
+        LOGGER.info("Sharing servos %s", sorted(self.slots))
+
+        self.scheduler.add_task(
+            self._run_commands, scheduler.CONTROL, 'commands'
+        )
+        self.scheduler.add_write_buffer(self.write_buffer)
+        self._add_state_reads()
+        self.scheduler.add_circuit_probe()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _SocketServer(self.socket_path, _RequestHandler)
+        self._server.daemon = self
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._server_thread.start()
+        self.scheduler.start()
+
+    def stop(self):
+        """Stops the daemon and removes the socket and shared memory.
+        Requests still waiting for the bus fail"""
+        self._stopped = True
+        self.scheduler.stop()
+        self._fail_commands('Daemon stopped')
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            os.unlink(self.socket_path)
+        if self.state is not None:
+            self.state.close()
+            self.state.unlink()
+            self.state = None
+
+    def _add_state_reads(self):
+        """Adds a control-priority sync read of the state registers for each
+        servo model, and a housekeeping full-table read per servo"""
+        by_model = {}
+        for address, model_number in self.models.items():
+            by_model.setdefault(model_number, []).append(address)
+        for model_number, addresses in by_model.items():
+            descriptor = servodata.get_servo(model_number)
+            registers = [
+                servodata.find_register(descriptor, name)
+                for name in self.state_registers
+            ]
+            registers = [reg for reg in registers if reg is not None]
+            if not registers:
+                continue
+            start = min(reg['address'] for reg in registers)
+            end = max(reg['address'] + reg['size'] for reg in registers)
+            self.scheduler.add_task(
+                functools.partial(self._read_state, addresses, start, end),
+                scheduler.CONTROL, 'state {}'.format(descriptor['name'])
+            )
+            for address in addresses:
+                self.scheduler.add_task(
+                    functools.partial(
+                        self._read_state, [address], 0,
+                        servodata.table_size(descriptor)
+                    ),
+                    scheduler.HOUSEKEEPING, 'table {}'.format(address)
+                )
+
+    def _read_state(self, addresses, start, end):
+        replies = self.bus.sync_read(addresses, start, end - start)
+        for address, data in replies.items():
+            self.state.publish(
+                self.slots[address], address, self.models[address], start,
+                data[1:], self.bus.sample_time_ns(address)
+            )
+
+    def _fail_commands(self, error):
+        """Fails every request waiting for the bus"""
+        while True:
+            try:
+                request, done = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            request['reply'] = {'ok': False, 'error': error}
+            done.set()
+
+    def _run_commands(self):
+        """Runs the requests that need an answer from the bus"""
+        while True:
+            try:
+                request, done = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if done.is_set():
+                # The client gave up waiting
+                continue
+            address = request['address']
+            if request['cmd'] == 'write':
+                result = self.bus.write(
+                    address, request['register'], request['data']
+                )
+                request['reply'] = {'ok': result is not None}
+            elif request['cmd'] == 'read':
+                result = self.bus.read(
+                    address, request['register'], request['length']
+                )
+                request['reply'] = {
+                    'ok': result is not None,
+                    'data': None if result is None else list(result),
+                }
+            else:
+                result = self.bus.ping(address)
+                request['reply'] = {'ok': result is not None, 'data': result}
+            done.set()
+
+    def handle_request(self, request):
+        """Handles a request from a client. Called from the socket server
+        threads. Setpoints ("set") are queued for the next cycle (a later
+        setpoint for the same register replaces an earlier one); "write",
+        "read" and "ping" wait for the bus"""
+        command = request['cmd']
+        if command == 'info':
+            return {
+                'ok': True,
+                'shm': self.shm_name,
+                'servos': [
+                    [address, self.models[address], slot]
+                    for address, slot in sorted(self.slots.items())
+                ],
+            }
+        if command == 'set':
+            self.write_buffer.set(
+                request['address'], request['register'], request['data']
+            )
+            return {'ok': True}
+        if command in ('write', 'read', 'ping'):
+            if self._stopped:
+                return {'ok': False, 'error': 'Daemon stopped'}
+            done = threading.Event()
+            self._commands.put((request, done))
+            if not done.wait(self.request_timeout):
+                # Stops the request being run if it is still queued
+                done.set()
+                return {'ok': False, 'error': 'Timed out waiting for the bus'}
+            return request['reply']
+        return {'ok': False, 'error': 'Unknown command {}'.format(command)}
+
+
+class DaemonClient:
+    """A connection to a BusDaemon from another process. servos is a dict
+    mapping address to a DaemonServo"""
+    def __init__(self, socket_path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._file = self._socket.makefile('rwb')
+        self._lock = threading.Lock()
+        info = self.request(cmd='info')
+        self.state = StateBlock.attach(info['shm'])
+        self.servos = {
+            address: DaemonServo(
+                self, address, slot, servodata.get_servo(model_number)
+            )
+            for address, model_number, slot in info['servos']
+        }
+
+    def request(self, **request):
+        """Sends a request to the daemon and returns its reply"""
+        with self._lock:
+            self._file.write(json.dumps(request).encode() + b'\n')
+            self._file.flush()
+            return json.loads(self._file.readline())
+
+    def close(self):
+        self.state.close()
+        self._file.close()
+        self._socket.close()
+
+
+class DaemonServo:
+    """Looks like a servo.Servo, but talks to a BusDaemon. get_* functions
+    return the latest value the daemon has read (reading shared memory, not
+    the bus). set_* functions queue a setpoint that the daemon sends on its
+    next cycle; pass wait=True to write straight away and wait for the
+    servo to acknowledge it instead"""
+    def __init__(self, client, address, slot, descriptor):
+        self.client = client
+        self.address = address
+        self.slot = slot
+        self.data = descriptor
+
+        for register in self.data['register_map']:
+            get_name = servo.format_register_name(register['name'], True)
+            set_name = servo.format_register_name(register['name'], False)
+            if 'R' in register['access'].upper():
+                self.__dict__[get_name] = functools.partial(
+                    self.get_register,
+                    register['address'],
+                    register['size'],
+                    register['display']
+                )
+            if 'W' in register['access'].upper():
+                self.__dict__[set_name] = functools.partial(
+                    self.set_register,
+                    register['address'],
+                    register['size'],
+                    register['display']
+                )
+
+    def get_register(self, register, length, display_info):
+        """Returns the latest value of a register, as parsed by the
+        display_info"""
+        table = self.client.state.snapshot(self.slot)[3]
+        return servo.format_data(
+            table[register:register + length], display_info
+        )
+
+    def set_register(self, register, length, display_info, value,
+                     wait=False):
+        """Returns True if the daemon accepted the value (or, with wait,
+        if the servo acknowledged it), None if it failed"""
+        data = list(provision.encode_register(
+            {'size': length, 'display': display_info}, value
+        ))
+        reply = self.client.request(
+            cmd='write' if wait else 'set', address=self.address,
+            register=register, data=data
+        )
+        return True if reply['ok'] else None
+
+    def get_timestamp_ns(self):
+        """Returns when this servo's published state was sampled, in
+        time.monotonic_ns() units"""
+        return self.client.state.snapshot(self.slot)[2]
+
+    def get_register_data(self):
+        """Returns a dict of data about the registers this servo has"""
+        return self.data['register_map']
+
+    def ping(self):
+        """Returns True if the servo answers a ping"""
+        return self.client.request(cmd='ping', address=self.address)['ok']
+
+    def __repr__(self):
+        return "Servo {} ({}, shared)".format(self.address, self.data['name'])
+
+
+def connect(port):
+    """Connects to the daemon for a serial port on its default socket"""
+    return DaemonClient(default_socket_path(port))
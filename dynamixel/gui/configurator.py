@@ -17,6 +17,7 @@ from gi.repository import Gtk, GLib, GObject
 import dynamixel.protocol2
 import dynamixel.servo
 import dynamixel.servodata
+import dynamixel.topology
 
 
 LOGGER = logging.getLogger(__name__)
@@ -49,8 +50,13 @@ class Configurator:
         self._registers = []
         self._scan_id = 0
         self.bus = None
+        self._port = None
+        self._baud = None
+        self._topology = dynamixel.topology.TopologyCache()
+        self._found_servos = {}
         self._current_servo = None
-        self._servo_list = Gtk.ListStore(int, str)
+        # Address, model name and model number (which isn't shown)
+        self._servo_list = Gtk.ListStore(int, str, int)
         
         self._setup_servo_list()
         self._insert_bauds()
@@ -99,6 +105,8 @@ class Configurator:
         baud = int(self.builder.get_object('baud_lister').get_active_text())
 
         LOGGER.debug("Creating bus with port=%s and baud=%d", port, baud)
+        self._port = port
+        self._baud = baud
         if port and baud:
             try:
                 uart = serial.Serial(port, baud, timeout=UART_TIMEOUT)
@@ -110,14 +118,25 @@ class Configurator:
             self.bus = None
 
     def start_scan(self, *_args):
-        """Starts the scan for servos. The actual scanning is handled by the
-        _continue_scan function"""
+        """Starts the scan for servos. If the servos found last time on this
+        port and baud rate are all still there, they are listed straight
+        away. Otherwise the actual scanning is handled by the _continue_scan
+        function"""
         self._current_servo = None
         self._servo_list.clear()
         self.clear_servo_registers()
         if self.bus is None:
             self.create_bus()
+        if self.bus is not None:
+            known = self._topology.get(self._port, self._baud)
+            if known and dynamixel.topology.check(self.bus, known):
+                LOGGER.info("Servos match the topology cache")
+                for address, info in sorted(known.items()):
+                    self._add_servo(address, info['model_number'])
+                self.builder.get_object('scan_progress').set_fraction(1.0)
+                return
         self._scan_id = 0
+        self._found_servos = {}
         self.builder.get_object('connect_button').set_sensitive(False)
         self.builder.get_object('scan_progress').set_fraction(0.0)
         GLib.idle_add(self._continue_scan)
@@ -128,22 +147,32 @@ class Configurator:
         self._scan_id += 1
         if self.bus is None or self._scan_id > 253:
             LOGGER.info("Found %d servos", len(self._servo_list))
+            if self.bus is not None:
+                self._topology.put(self._port, self._baud, self._found_servos)
+                self._topology.save()
             self.builder.get_object('connect_button').set_sensitive(True)
             self.builder.get_object('scan_progress').set_fraction(1.0)
             return False
 
         self.builder.get_object('scan_progress').set_fraction(self._scan_id/253)
-        servo_model = self.bus.ping(self._scan_id)
-        if servo_model is not None:
+        found = dynamixel.topology.scan(self.bus, [self._scan_id])
+        if found:
             LOGGER.info("Found Servo at %d", self._scan_id)
-            servo_data = dynamixel.servodata.get_servo(servo_model)
-            if servo_data is None:
-                servo_name = '??'
-            else:
-                servo_name = servo_data['name']
-            self._servo_list.append([self._scan_id, servo_name])
+            self._found_servos.update(found)
+            self._add_servo(
+                self._scan_id, found[self._scan_id]['model_number']
+            )
 
         return True
+
+    def _add_servo(self, address, servo_model):
+        """Adds a servo to the list of found servos"""
+        servo_data = dynamixel.servodata.get_servo(servo_model)
+        if servo_data is None:
+            servo_name = '??'
+        else:
+            servo_name = servo_data['name']
+        self._servo_list.append([address, servo_name, servo_model])
         
     def clear_servo_registers(self):
         for item in self._registers:
@@ -194,7 +223,8 @@ class Configurator:
                 LOGGER.warning("How do we have a servo listing and no bus?")
                 return
 
-            servo_model = self.bus.ping(servo_address)
+            # The model was found when scanning, so no need to ping again
+            servo_model = self._servo_list.get_value(servo_id, 2)
             servo_data = dynamixel.servodata.get_servo(servo_model)
             self.set_current_servo(dynamixel.servo.Servo(
                 self.bus, servo_address, servo_data
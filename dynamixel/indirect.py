@@ -0,0 +1,209 @@
+"""Packs registers that are spread around the control table into one
+contiguous block, so they can be read or written in a single transaction.
+
+X-series servos have Indirect Address registers (two bytes each) and
+Indirect Data registers (one byte each). Indirect Data N behaves as if it
+were the byte of the control table given by Indirect Address N, so pointing
+consecutive slots at the bytes of several registers makes them appear next
+to each other:
+
+    block = IndirectBlock(
+        servodata.get_servo(1020),
+        ['Goal Position', 'Present Position', 'Present Current']
+    )
+    block.program(bus, 1)
+    values = block.read(bus, 1)
+    block.write(bus, 1, {'Goal Position': 90})
+    group_values = block.read_group(bus, [1, 2, 3])
+
+The indirect addresses live in RAM, so the block has to be programmed again
+after the servo is power cycled (is_programmed checks this). Some models
+only accept changes to the indirect addresses while the torque is off."""
+import logging
+
+from . import provision, servo, servodata
+
+LOGGER = logging.getLogger(__name__)
+
+INDIRECT_ADDRESS = 'Indirect Address {}'
+INDIRECT_DATA = 'Indirect Data {}'
+
+
+def indirect_slots(descriptor):
+    """Returns how many Indirect Address/Indirect Data pairs a servo has"""
+    slots = 0
+    while True:
+        slot = slots + 1
+        address = servodata.find_register(
+            descriptor, INDIRECT_ADDRESS.format(slot)
+        )
+        data = servodata.find_register(descriptor, INDIRECT_DATA.format(slot))
+        if address is None or data is None:
+            return slots
+        slots = slot
+
+
+class IndirectBlock:
+    """Maps the named registers, in order, into the Indirect Data registers
+    of servos of one model, starting at slot first_slot. Several blocks can
+    be used on the same servo as long as their slots don't overlap.
+    Raises ValueError if the servo has no such registers or there are not
+    enough slots"""
+    def __init__(self, descriptor, register_names, first_slot=1):
+        self.descriptor = descriptor
+        self.first_slot = first_slot
+        self.registers = []
+        for name in register_names:
+            register = servodata.find_register(descriptor, name)
+            if register is None:
+                raise ValueError("{} has no {} register".format(
+                    descriptor['name'], name
+                ))
+            self.registers.append(register)
+
+        self.offsets = {}
+        self.targets = []
+        for register in self.registers:
+            self.offsets[register['name']] = len(self.targets)
+            self.targets += range(
+                register['address'], register['address'] + register['size']
+            )
+        self.size = len(self.targets)
+
+        last_slot = first_slot + self.size - 1
+        if first_slot < 1 or last_slot > indirect_slots(descriptor):
+            raise ValueError(
+                "{} does not have indirect slots {} to {}".format(
+                    descriptor['name'], first_slot, last_slot
+                )
+            )
+        self.address_register = servodata.find_register(
+            descriptor, INDIRECT_ADDRESS.format(first_slot)
+        )['address']
+        self.data_register = servodata.find_register(
+            descriptor, INDIRECT_DATA.format(first_slot)
+        )['address']
+
+    def address_map(self):
+        """Returns the bytes to write to the Indirect Address registers"""
+        data = []
+        for target in self.targets:
+            data += [target % 256, target >> 8]
+        return data
+
+    def program(self, bus, address):
+        """Points a servo's indirect addresses at the registers of the block.
+        Returns True if it succeeded"""
+        result = bus.write(address, self.address_register, self.address_map())
+        if result is None:
+            LOGGER.error(
+                "Failed to program indirect addresses of servo %d", address
+            )
+            return False
+        return True
+
+    def program_group(self, bus, addresses):
+        """Programs several servos with a single sync write. Servos don't
+        reply to sync writes, so this returns the addresses that were found
+        to be programmed when read back"""
+        address_map = self.address_map()
+        bus.sync_write(self.address_register, len(address_map), {
+            address: address_map for address in addresses
+        })
+        return [
+            address for address in addresses
+            if self.is_programmed(bus, address)
+        ]
+
+    def is_programmed(self, bus, address):
+        """Returns True if a servo's indirect addresses match this block"""
+        address_map = self.address_map()
+        data = bus.read(address, self.address_register, len(address_map))
+        return data is not None and list(data[1:]) == address_map
+
+    def decode(self, data):
+        """Converts the contents of the block's Indirect Data registers into
+        {register_name: value}"""
+        values = {}
+        for register in self.registers:
+            offset = self.offsets[register['name']]
+            values[register['name']] = servo.format_data(
+                data[offset:offset + register['size']], register['display']
+            )
+        return values
+
+    def encode(self, values):
+        """Converts {register_name: value} into (offset, data) for the
+        smallest run of the block covering them. Raises ValueError if the
+        run would overwrite a register that has no value, or a register
+        that can't be written"""
+        names = set(values)
+        unknown = names - set(self.offsets)
+        if unknown:
+            raise ValueError("{} are not in the block".format(sorted(unknown)))
+        covered = [
+            register for register in self.registers
+            if register['name'] in names
+        ]
+        first = self.registers.index(covered[0])
+        last = self.registers.index(covered[-1])
+        data = []
+        for register in self.registers[first:last + 1]:
+            if register['name'] not in names:
+                raise ValueError(
+                    "Writing {} would also overwrite {}".format(
+                        sorted(names), register['name']
+                    )
+                )
+            if 'W' not in register['access'].upper():
+                raise ValueError("{} is read only".format(register['name']))
+            data += provision.encode_register(
+                register, values[register['name']]
+            )
+        return self.offsets[covered[0]['name']], data
+
+    def read(self, bus, address):
+        """Reads every register of the block from a servo in one read.
+        Returns {register_name: value}, or None if the read failed"""
+        data = bus.read(address, self.data_register, self.size)
+        if data is None:
+            return None
+        return self.decode(data[1:])
+
+    def read_group(self, bus, addresses):
+        """Reads the block from several servos with a single sync read.
+        Returns {address: {register_name: value}} for the servos that
+        replied"""
+        replies = bus.sync_read(addresses, self.data_register, self.size)
+        return {
+            address: self.decode(data[1:])
+            for address, data in replies.items()
+        }
+
+    def write(self, bus, address, values):
+        """Writes {register_name: value} to a servo in one write. Returns
+        True if succeeded, None if failed"""
+        if not values:
+            return True
+        offset, data = self.encode(values)
+        if bus.write(address, self.data_register + offset, data) is None:
+            return None
+        return True
+
+    def write_group(self, bus, values):
+        """Writes {address: {register_name: value}} with a single sync write.
+        Every servo must be given the same registers"""
+        if not values:
+            return
+        runs = {
+            address: self.encode(servo_values)
+            for address, servo_values in values.items()
+        }
+        offsets = {offset for offset, data in runs.values()}
+        lengths = {len(data) for offset, data in runs.values()}
+        if len(offsets) != 1 or len(lengths) != 1:
+            raise ValueError("Every servo must be given the same registers")
+        bus.sync_write(
+            self.data_register + offsets.pop(), lengths.pop(),
+            {address: data for address, (offset, data) in runs.items()}
+        )
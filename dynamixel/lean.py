@@ -0,0 +1,389 @@
+"""A lean version of the protocol2 and servo modules for microcontrollers.
+
+This file has no dependencies (apart from array) so it can be copied onto a
+MicroPython board on its own. It has the same API as protocol2.Protocol2Bus
+and servo.Servo, but:
+
+ - Packets are built in, and received into, buffers allocated once when the
+   bus is created. The memoryviews used to send and receive parts of them
+   are made the first time each size is needed and kept, so once every
+   packet size has been seen a transaction allocates nothing at all.
+ - Replies are returned as a memoryview into the receive buffer rather than
+   a new bytes object. It is only valid until the next transaction on the
+   bus, so copy it if you need to keep it.
+ - Nothing is logged. The reason for the last failure is kept in
+   bus.last_error instead.
+ - Servo looks registers up by name when they are first used rather than
+   building a function per register up front.
+"""
+from array import array
+
+MAX_PARAMETERS = 256
+HEADER_SIZE = 7
+TX_SIZE = HEADER_SIZE + 1 + MAX_PARAMETERS + 2
+RX_SIZE = HEADER_SIZE + 2 + MAX_PARAMETERS + 2
+
+PING = 0x01
+READ = 0x02
+WRITE = 0x03
+STATUS = 0x55
+
+ERR_NONE = None
+ERR_ECHO = 'echo'
+ERR_TIMEOUT = 'timeout'
+ERR_HEADER = 'header'
+ERR_CRC = 'crc'
+ERR_STATUS = 'status'
+ERR_SERVO = 'servo'
+
+
+def _make_crc_table():
+    """Dynamixel uses the CRC-16 with polynomial 0x8005"""
+    table = array('H', bytes(512))
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x8005) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[i] = crc
+    return table
+
+
+CRC_TABLE = _make_crc_table()
+
+
+def crc16(data, val=0):
+    """Computes dynamixels CRC"""
+    return _crc(data, 0, len(data), val)
+
+
+def _view(views, buffer_view, start, count):
+    """Returns buffer_view[start:start + count], which is made the first
+    time and kept in views (a list indexed by count) after that"""
+    view = views[count]
+    if view is None:
+        view = views[count] = buffer_view[start:start + count]
+    return view
+
+
+def _crc(data, start, end, val=0):
+    table = CRC_TABLE
+    for pos in range(start, end):
+        val = ((val << 8) ^ table[(val >> 8) ^ data[pos]]) & 0xFFFF
+    return val
+
+
+class Protocol2Bus:
+    """Talks protocol2 over a UART using preallocated buffers. The uart
+    needs .write() and .readinto() (both pyserial and MicroPython's UART
+    have these)"""
+    def __init__(self, uart):
+        self.uart = uart
+        self.last_error = ERR_NONE
+        self._tx = bytearray(TX_SIZE)
+        self._rx = bytearray(RX_SIZE)
+        self._tx_view = memoryview(self._tx)
+        self._rx_view = memoryview(self._rx)
+        # Views of the start of the transmit buffer, of the start of the
+        # receive buffer, of the receive buffer after the header and of the
+        # reply in the receive buffer, indexed by length
+        self._tx_views = [None] * (TX_SIZE + 1)
+        self._echo_views = [None] * (RX_SIZE + 1)
+        self._body_views = [None] * (RX_SIZE - HEADER_SIZE + 1)
+        self._reply_views = [None] * (RX_SIZE - 8 + 1)
+        self._tx[0:4] = b'\xff\xff\xfd\x00'
+        self._flush = getattr(uart, 'flush', None)
+        self._reset_input = getattr(uart, 'reset_input_buffer', None)
+
+    def ping(self, address):
+        """Attempts to ping a servo. Returns the servo model number if it is
+        present, or None if no servo was detected"""
+        data = self._transact(address, PING, 0)
+        if data is None:
+            return None
+        return data[1] + (data[2] << 8)
+
+    def read(self, address, register, length):
+        """Reads the registers on a device. Returns the alarm byte followed
+        by the data (see protocol2.Protocol2Bus.read) or None"""
+        tx = self._tx
+        tx[8] = register & 0xFF
+        tx[9] = register >> 8
+        tx[10] = length & 0xFF
+        tx[11] = length >> 8
+        return self._transact(address, READ, 4)
+
+    def write(self, address, register, data):
+        """Writes to an address on the device"""
+        tx = self._tx
+        tx[8] = register & 0xFF
+        tx[9] = register >> 8
+        length = len(data)
+        for pos in range(length):
+            tx[10 + pos] = data[pos]
+        return self._transact(address, WRITE, 2 + length)
+
+    def write_value(self, address, register, length, value):
+        """Writes an integer to length bytes of registers, without building
+        a list of bytes first"""
+        tx = self._tx
+        tx[8] = register & 0xFF
+        tx[9] = register >> 8
+        for pos in range(length):
+            tx[10 + pos] = (value >> (8 * pos)) & 0xFF
+        return self._transact(address, WRITE, 2 + length)
+
+    def send_and_wait(self, address, instruction, parameters):
+        """Sends a packet on the bus and waits for the reply. Returns the
+        servo error state and data (as a memoryview into the receive
+        buffer), or None"""
+        tx = self._tx
+        count = len(parameters)
+        for pos in range(count):
+            tx[8 + pos] = parameters[pos]
+        return self._transact(address, instruction, count)
+
+    def send_blind(self, address, instruction, parameters):
+        """Sends a message without attempting to receive"""
+        tx = self._tx
+        count = len(parameters)
+        for pos in range(count):
+            tx[8 + pos] = parameters[pos]
+        length = self._finish(address, instruction, count)
+        self.uart.write(_view(self._tx_views, self._tx_view, 0, length))
+
+    @staticmethod
+    def _build_packet(address, instruction, parameters):
+        """Returns a complete packet as bytes. This allocates, so the bus
+        itself doesn't use it"""
+        packet = bytearray(HEADER_SIZE + 1 + len(parameters) + 2)
+        packet[0:4] = b'\xff\xff\xfd\x00'
+        packet[4] = address
+        packet[5] = (len(parameters) + 3) & 0xFF
+        packet[6] = (len(parameters) + 3) >> 8
+        packet[7] = instruction
+        packet[8:8 + len(parameters)] = bytes(parameters)
+        crc = crc16(packet[:-2])
+        packet[-2] = crc & 0xFF
+        packet[-1] = crc >> 8
+        return bytes(packet)
+
+    def _finish(self, address, instruction, count):
+        """Fills in the header and CRC of the packet in the transmit buffer,
+        whose parameters are already in place. Returns the packet length"""
+        tx = self._tx
+        tx[4] = address
+        tx[5] = (count + 3) & 0xFF
+        tx[6] = (count + 3) >> 8
+        tx[7] = instruction
+        end = 8 + count
+        crc = _crc(tx, 0, end)
+        tx[end] = crc & 0xFF
+        tx[end + 1] = crc >> 8
+        return end + 2
+
+    def _read_exactly(self, views, start, count):
+        """Reads count bytes into the receive buffer at start (views holds
+        the views starting there). Returns True if they all arrived"""
+        got = self.uart.readinto(_view(views, self._rx_view, start, count))
+        return got == count
+
+    def _transact(self, address, instruction, count):
+        """Sends the packet in the transmit buffer and receives the reply
+        into the receive buffer"""
+        tx = self._tx
+        rx = self._rx
+        length = self._finish(address, instruction, count)
+        if self._flush is not None:
+            self._flush()
+        if self._reset_input is not None:
+            self._reset_input()
+        self.uart.write(_view(self._tx_views, self._tx_view, 0, length))
+        if self._flush is not None:
+            self._flush()
+
+        # The half-duplex bus echoes what was sent
+        if not self._read_exactly(self._echo_views, 0, length):
+            self.last_error = ERR_ECHO
+            return None
+        for pos in range(length):
+            if rx[pos] != tx[pos]:
+                self.last_error = ERR_ECHO
+                return None
+
+        if not self._read_exactly(self._echo_views, 0, HEADER_SIZE):
+            self.last_error = ERR_TIMEOUT
+            return None
+        for pos in range(5):
+            if rx[pos] != tx[pos]:
+                self.last_error = ERR_HEADER
+                return None
+        packet_len = rx[5] + (rx[6] << 8)
+        if packet_len < 4 or HEADER_SIZE + packet_len > RX_SIZE:
+            self.last_error = ERR_HEADER
+            return None
+        if not self._read_exactly(self._body_views, HEADER_SIZE, packet_len):
+            self.last_error = ERR_TIMEOUT
+            return None
+
+        end = HEADER_SIZE + packet_len
+        if _crc(rx, 0, end - 2) != rx[end - 2] + (rx[end - 1] << 8):
+            self.last_error = ERR_CRC
+            return None
+        if rx[7] != STATUS:
+            self.last_error = ERR_STATUS
+            return None
+        if rx[8] & 0x7F:
+            self.last_error = ERR_SERVO
+            return None
+        self.last_error = ERR_NONE
+        return _view(self._reply_views, self._rx_view, 8, end - 10)
+
+
+class Servo:
+    """A servo on a lean Protocol2Bus. Works like servo.Servo (get_<register>
+    and set_<register> functions named after the descriptor's registers),
+    but the functions are only made when they are first used (and then
+    kept)"""
+    def __init__(self, bus, address, descriptor=None):
+        self.bus = bus
+        self.address = address
+        self.data = descriptor
+        self.on_hardware_error = []
+        self._registers = {}
+        if descriptor is not None:
+            for register in descriptor['register_map']:
+                name = register['name'].lower().replace(' ', '_')
+                self._registers[name] = register
+
+    def __getattr__(self, name):
+        register = self.__dict__['_registers'].get(name[4:])
+        accessor = None
+        if register is not None:
+            access = register['access'].upper()
+            if name.startswith('get_') and 'R' in access:
+                def accessor():
+                    return self.get_register(
+                        register['address'], register['size'],
+                        register['display']
+                    )
+            elif name.startswith('set_') and 'W' in access:
+                def accessor(value):
+                    return self.set_register(
+                        register['address'], register['size'],
+                        register['display'], value
+                    )
+        if accessor is None:
+            raise AttributeError(name)
+        # Kept on the instance, so __getattr__ isn't needed next time
+        self.__dict__[name] = accessor
+        return accessor
+
+    def __dir__(self):
+        names = list(self.__dict__) + [
+            'get_register', 'set_register', 'get_register_data', 'ping'
+        ]
+        for name, register in self._registers.items():
+            if 'R' in register['access'].upper():
+                names.append('get_' + name)
+            if 'W' in register['access'].upper():
+                names.append('set_' + name)
+        return names
+
+    def get_register(self, register, length, display_info):
+        """Returns the value of a register, as parsed by the display_info"""
+        got_data = self.bus.read(self.address, register, length)
+        if got_data is None:
+            return None
+        self._check_hardware_error(got_data[0])
+        return format_data(got_data, display_info, 1)
+
+    def set_register(self, register, length, display_info, value):
+        """Returns True if succeeded, None if failed"""
+        result = self.bus.write_value(
+            self.address, register, length,
+            format_value_inverse(value, display_info)
+        )
+        if result is None:
+            return None
+        self._check_hardware_error(result[0])
+        return True
+
+    def _check_hardware_error(self, byte):
+        if byte != 0:
+            for funct in self.on_hardware_error:
+                funct(self)
+
+    def get_register_data(self):
+        """Returns a dict of data about the registers this servo has"""
+        if self.data is not None:
+            return self.data['register_map']
+        return None
+
+    def ping(self):
+        """Returns True if the ping succeeds, otherwise it returns False"""
+        return self.bus.ping(self.address) is not None
+
+    def __repr__(self):
+        name = '??'
+        if self.data is not None:
+            name = self.data['name']
+        return "Servo {} ({})".format(self.address, name)
+
+
+def format_data(data, display_info, start=0):
+    """The same as servo.format_data, but only data from start onwards is
+    used (so a reply can be decoded without slicing off the alarm byte)"""
+    display_type = display_info['type']
+    if display_type == "bytes":
+        return bytes(data[start:])
+
+    combined = 0
+    size = len(data) - start
+    for pos in range(size):
+        combined += data[start + pos] << (8 * pos)
+    if display_info.get('signed') and size and combined >> (8 * size - 1):
+        combined -= 1 << (8 * size)
+    if 'offset' in display_info:
+        combined -= display_info['offset']
+    if 'scale' in display_info:
+        combined *= display_info['scale']
+
+    if display_type == 'int':
+        return int(combined)
+    if display_type == 'float':
+        return float(combined)
+    if display_type == "hex":
+        return '{:x}'.format(combined)
+    if display_type == "bool":
+        return bool(combined)
+    return bytes(data[start:])
+
+
+def format_value_inverse(data, display_info):
+    """Like servo.format_data_inverse, but returns the register contents
+    as a single integer rather than a list of bytes. Values of signed
+    registers may be negative: Bus.write_value stores them in two's
+    complement"""
+    display_type = display_info['type']
+    value = 0
+    if display_type == "bytes":
+        return int.from_bytes(bytes(data), 'little')
+    if display_type == "hex":
+        value = int(data, 16)
+    elif display_type == 'float':
+        value = float(data)
+    elif display_type in ('int', 'bool'):
+        value = int(data)
+
+    if 'scale' in display_info:
+        value = value / display_info['scale']
+    if 'offset' in display_info:
+        value += display_info['offset']
+    if 'min' in display_info:
+        value = max(display_info['min'], value)
+    if 'max' in display_info:
+        value = min(display_info['max'], value)
+    return int(value)
@@ -0,0 +1,142 @@
+"""A local copy of the control tables of a group of servos.
+
+The mirror holds the control table of every servo in one contiguous
+bytearray (one row per servo). Reads through the mirror copy the data from
+each status packet straight into the right place in that buffer, and values
+are only decoded when they are asked for:
+
+    mirror = ControlTableMirror(servodata.get_servo(350), [1, 2, 3])
+    mirror.refresh(bus, ['Present Position', 'Present Speed'])
+    position = mirror['Present Position'][2]
+    positions = mirror['Present Position'].all()
+
+Reading a value from the mirror never touches the bus. The mirror also
+keeps the time each servo's row was sampled, so snapshot() can return
+time-aligned values (see dynamixel.snapshot)."""
+from . import servo, servodata
+from .snapshot import Snapshot
+
+
+class RegisterView:
+    """Gives typed access to one register of every servo in a mirror.
+    Index it with a servo address to get the decoded value"""
+    def __init__(self, mirror, register):
+        self.mirror = mirror
+        self.register = register
+        self.name = register['name']
+        self.address = register['address']
+        self.size = register['size']
+        self.display = register['display']
+
+    def raw(self, address):
+        """Returns the register of a servo as a memoryview into the mirror
+        (no copy is made)"""
+        row = self.mirror.row(address)
+        return row[self.address:self.address + self.size]
+
+    def value(self, address):
+        """Returns the register of a servo as an unsigned integer"""
+        return int.from_bytes(self.raw(address), 'little')
+
+    def __getitem__(self, address):
+        return servo.format_data(self.raw(address), self.display)
+
+    def all(self):
+        """Returns a dict mapping each servo address to its decoded value"""
+        return {address: self[address] for address in self.mirror.addresses}
+
+    def __repr__(self):
+        return "RegisterView {}".format(self.name)
+
+
+class ControlTableMirror:
+    """Mirrors the control tables of servos that share a descriptor. See the
+    module docstring"""
+    def __init__(self, descriptor, addresses):
+        self.descriptor = descriptor
+        self.addresses = list(addresses)
+        self.table_size = servodata.table_size(descriptor)
+        self.buffer = bytearray(self.table_size * len(self.addresses))
+        self.view = memoryview(self.buffer)
+        self._rows = {
+            address: self.view[
+                index * self.table_size:(index + 1) * self.table_size
+            ]
+            for index, address in enumerate(self.addresses)
+        }
+        self.alarms = {address: 0 for address in self.addresses}
+        self.sample_ns = {address: None for address in self.addresses}
+        self.registers = {
+            register['name']: RegisterView(self, register)
+            for register in descriptor['register_map']
+        }
+
+    def row(self, address):
+        """Returns the control table of a servo as a memoryview"""
+        return self._rows[address]
+
+    def __getitem__(self, register_name):
+        return self.registers[register_name]
+
+    def get(self, address, register_name):
+        """Returns the decoded value of a register of a servo"""
+        return self.registers[register_name][address]
+
+    def update(self, address, register, data):
+        """Copies data into a servo's row, starting at register"""
+        self._rows[address][register:register + len(data)] = data
+
+    def span(self, register_names=None):
+        """Returns (register, length) of the smallest block of the control
+        table covering the named registers (or all of them)"""
+        if register_names is None:
+            registers = self.registers.values()
+        else:
+            registers = [self.registers[name] for name in register_names]
+        start = min(reg.address for reg in registers)
+        end = max(reg.address + reg.size for reg in registers)
+        return start, end - start
+
+    def refresh(self, bus, register_names=None, addresses=None):
+        """Reads the named registers (all of them if None) from the servos
+        (all of them if None) with a single sync read covering them, storing
+        the results in the mirror. Returns the addresses that replied"""
+        register, length = self.span(register_names)
+        addresses = self.addresses if addresses is None else addresses
+        destinations = {
+            address: self._rows[address][register:register + length]
+            for address in addresses
+        }
+        alarms = bus.sync_read_into(addresses, register, length, destinations)
+        self.alarms.update(alarms)
+        for address in alarms:
+            self.sample_ns[address] = bus.sample_time_ns(address)
+        return list(alarms)
+
+    def refresh_servo(self, bus, address, register_names=None):
+        """Reads the named registers of a single servo with a normal read.
+        Returns True if it succeeded"""
+        register, length = self.span(register_names)
+        alarm = bus.read_into(
+            address, register, length,
+            self._rows[address][register:register + length]
+        )
+        if alarm is None:
+            return False
+        self.alarms[address] = alarm
+        self.sample_ns[address] = bus.sample_time_ns(address)
+        return True
+
+    def snapshot(self, register_names, previous=None):
+        """Returns a Snapshot of the decoded values of the named registers of
+        every servo, with the time each servo was sampled. Pass the
+        previous snapshot to be able to align the values to one time"""
+        views = [self.registers[name] for name in register_names]
+        return Snapshot(
+            {
+                address: {view.name: view[address] for view in views}
+                for address in self.addresses
+            },
+            dict(self.sample_ns),
+            previous
+        )
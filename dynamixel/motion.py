@@ -0,0 +1,131 @@
+"""Waiting for servos to finish moving.
+
+Rather than sleeping for as long as the slowest move could take, poll the
+servos until they get there:
+
+    for serv in servos:
+        serv.set_goal_position(45)
+    motion.wait_until_reached(servos)
+
+Each poll reads the Present Position and Moving registers of the whole
+group with one sync read per bus and model. Polls are close together when
+a servo is about to arrive, and further apart while it is still far away
+(going by how fast it has been moving)."""
+import logging
+import time
+
+from . import servodata
+from .mirror import ControlTableMirror
+
+LOGGER = logging.getLogger(__name__)
+
+PRESENT_POSITION = 'Present Position'
+GOAL_POSITION = 'Goal Position'
+MOVING = 'Moving'
+
+# Degrees
+DEFAULT_TOLERANCE = 2.0
+# Seconds
+DEFAULT_TIMEOUT = 5.0
+MIN_INTERVAL = 0.005
+MAX_INTERVAL = 0.1
+
+
+class _Group:
+    """Servos on the same bus that are the same model, polled together"""
+    def __init__(self, bus, descriptor, servos):
+        self.bus = bus
+        self.servos = servos
+        self.mirror = ControlTableMirror(
+            descriptor, [serv.address for serv in servos]
+        )
+        self.has_moving = (
+            servodata.find_register(descriptor, MOVING) is not None
+        )
+
+    def poll(self, register_names):
+        """Reads the registers of every servo in the group. Returns the
+        addresses that replied"""
+        names = list(register_names)
+        if self.has_moving:
+            names.append(MOVING)
+        return self.mirror.refresh(self.bus, names)
+
+
+def _make_groups(servos):
+    groups = {}
+    for serv in servos:
+        if serv.data is None:
+            raise ValueError("{} has no descriptor".format(serv))
+        key = (id(serv.bus), serv.data['model_number'])
+        groups.setdefault(key, (serv.bus, serv.data, []))[2].append(serv)
+    return [
+        _Group(bus, descriptor, group_servos)
+        for bus, descriptor, group_servos in groups.values()
+    ]
+
+
+def wait_until_reached(servos, targets=None, tolerance=DEFAULT_TOLERANCE,
+                       timeout=DEFAULT_TIMEOUT, min_interval=MIN_INTERVAL,
+                       max_interval=MAX_INTERVAL):
+    """Waits until every servo is within tolerance degrees of its target
+    and has stopped moving. targets maps each servo to its target position;
+    by default each servo's Goal Position is read from it (so set it, and
+    commit any write buffer, first).
+
+    Returns True as soon as every servo has got there, or False if they
+    haven't after timeout seconds"""
+    servos = list(servos)
+    groups = _make_groups(servos)
+    register_names = [PRESENT_POSITION]
+    if targets is None:
+        register_names.append(GOAL_POSITION)
+
+    deadline = time.monotonic() + timeout
+    last_positions = {}
+    while True:
+        now = time.monotonic()
+        waiting_for = []
+        remaining_time = 0.0
+        for group in groups:
+            replied = group.poll(register_names)
+            for serv in group.servos:
+                if serv.address not in replied:
+                    waiting_for.append(serv)
+                    continue
+                mirror = group.mirror
+                position = mirror.get(serv.address, PRESENT_POSITION)
+                if targets is None:
+                    target = mirror.get(serv.address, GOAL_POSITION)
+                else:
+                    target = targets[serv]
+                moving = group.has_moving and mirror.get(serv.address, MOVING)
+                distance = abs(target - position)
+                if distance <= tolerance and not moving:
+                    continue
+                waiting_for.append(serv)
+
+                # How long until this servo gets there, at its current speed
+                sampled = mirror.sample_ns[serv.address] / 1e9
+                last = last_positions.get(serv)
+                last_positions[serv] = (sampled, position)
+                if distance <= tolerance or last is None or sampled <= last[0]:
+                    continue
+                speed = abs(position - last[1]) / (sampled - last[0])
+                if speed:
+                    estimate = (distance - tolerance) / speed
+                else:
+                    estimate = float('inf')
+                remaining_time = max(remaining_time, estimate)
+
+        if not waiting_for:
+            return True
+        if now >= deadline:
+            LOGGER.warning(
+                "Servos %s did not reach their targets", waiting_for
+            )
+            return False
+
+        # Poll again about halfway through the expected time left
+        interval = min(max(remaining_time / 2, min_interval), max_interval)
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
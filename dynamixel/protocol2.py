@@ -2,25 +2,156 @@
 includes constructing the various packet types (eg read packet, write packet,
 ping)'''
 import logging
+import time
 
 LOGGER = logging.getLogger(__name__)
 
+HEADER = b'\xff\xff\xfd\x00'
+BROADCAST_ADDRESS = 0xFE
+
+# Instructions
+PING = 0x01
+READ = 0x02
+WRITE = 0x03
+REG_WRITE = 0x04
+ACTION = 0x05
+FACTORY_RESET = 0x06
+REBOOT = 0x08
+STATUS = 0x55
+SYNC_READ = 0x82
+SYNC_WRITE = 0x83
+BULK_READ = 0x92
+BULK_WRITE = 0x93
+
+# Status Return Levels: which instructions a servo sends a status packet for
+RETURN_PING = 0
+RETURN_READ = 1
+RETURN_ALL = 2
+
+
+class RetryPolicy:
+    """Controls how hard the bus tries to talk to a servo.
+
+    retries is how many times a failed transaction is repeated, waiting
+    backoff seconds before the first retry and doubling each time after.
+    If resync is set, anything left in the input buffer (such as a reply
+    that arrived after the timeout) is drained before retrying.
+
+    After failure_threshold consecutive failed transactions the circuit to
+    that servo opens: the bus stops talking to it (calls return None
+    straight away) and drops it from group operations. While open, a single
+    attempt is let through every probe_interval seconds, and the circuit
+    closes again once the servo answers. Circuits are only tracked for
+    servos that have answered at least once, so scanning for servos does
+    not open any. Set failure_threshold to None to disable circuits.
+
+    Servos left out of group operations are only probed by
+    Protocol2Bus.probe_open_circuits, which is best run in the background
+    (see BusScheduler.add_circuit_probe). If probe_inline is set, every
+    group operation also probes one servo that is due, at the cost of
+    the group operation waiting for it."""
+    def __init__(self, retries=0, backoff=0.0, resync=True,
+                 failure_threshold=3, probe_interval=1.0, probe_inline=False):
+        self.retries = retries
+        self.backoff = backoff
+        self.resync = resync
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_inline = probe_inline
+
+
+class ServoHealth:
+    """Tracks how communication with a single servo is going, and whether
+    the circuit to it is open"""
+    def __init__(self, address, policy):
+        self.address = address
+        self.policy = policy
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.opened_at = None
+        self.last_attempt = None
+
+    @property
+    def is_open(self):
+        """True if the bus has given up on this servo for now"""
+        return self.opened_at is not None
+
+    def probe_due(self, now):
+        """True if the circuit is open and it is time to try again"""
+        return self.is_open and (
+            now - self.last_attempt >= self.policy.probe_interval
+        )
+
+    def allow(self, now):
+        """Returns True if a transaction with the servo should be attempted.
+        While the circuit is open this is only True once per probe
+        interval"""
+        if not self.is_open:
+            return True
+        if self.probe_due(now):
+            self.last_attempt = now
+            return True
+        return False
+
+    def record_success(self):
+        if self.is_open:
+            LOGGER.info("Circuit to servo %d closed again", self.address)
+        self.consecutive_failures = 0
+        self.total_successes += 1
+        self.opened_at = None
+
+    def record_failure(self, now):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        self.last_attempt = now
+        threshold = self.policy.failure_threshold
+        if (not self.is_open and threshold is not None
+                and self.consecutive_failures >= threshold):
+            LOGGER.warning(
+                "Circuit to servo %d opened after %d failures in a row",
+                self.address, self.consecutive_failures
+            )
+            self.opened_at = now
+
 
 class Protocol2Bus:
     """Constructs a higher abstraction over the UART to allow sending and
     receiving protocol2 packets.
     The uart should support .read() and .write(), which should both
-    return bytearrays."""
-    def __init__(self, uart):
+    return bytearrays.
+
+    How failed transactions are retried, and when the bus gives up on an
+    unresponsive servo, is set by the retry_policy (see RetryPolicy). The
+    ServoHealth of each servo that has answered is kept in bus.health
+
+    The firmware version reported by each servo that answers a ping is
+    kept in bus.firmware
+
+    bus.return_levels holds the Status Return Level of servos (see
+    replies_to). Servos missing from it are assumed to reply to everything
+
+    Every status packet received is timestamped (see sample_time_ns).
+    return_delay_us should be set to the servos' Return Delay Time so that
+    the estimate of when a servo took its reading is accurate"""
+    def __init__(self, uart, retry_policy=None, return_delay_us=0):
         self.uart = uart
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.return_delay_us = return_delay_us
+        self.health = {}
+        self.rx_times = {}
+        self.firmware = {}
+        self.return_levels = {}
 
     def ping(self, address):
         """Attempts to ping a servo. Returns the servo model number if it is
         present, or None if no servo was detected"""
         LOGGER.debug("Pinging servo %d", address)
-        data = self.send_and_wait(address, 0x01, [])
+        data = self.send_and_wait(address, PING, [])
         if data is not None:
             servo_id = data[1] + (data[2]<<8)
+            if len(data) > 3:
+                self.firmware[address] = data[3]
             LOGGER.debug(
                 "Found servo at %d with model number %d",
                 address, servo_id
@@ -40,7 +171,7 @@ class Protocol2Bus:
             "Reading from servo %d (register %d, length %d) ",
             address, register, length
         )
-        data = self.send_and_wait(address, 0x02, [
+        data = self.send_and_wait(address, READ, [
             register % 256,
             (register >> 8),
             length % 256,
@@ -51,8 +182,14 @@ class Protocol2Bus:
         LOGGER.debug("No useful response from servo at %d", address)
         return None
 
-    def write(self, address, register, data):
-        """Writes to an address on the device."""
+    def write(self, address, register, data, verify=False):
+        """Writes to an address on the device. Returns the alarm byte of the
+        reply as a single item list, or None if the write failed.
+
+        If the servo's return level means it won't reply, the write is sent
+        without waiting and an empty list is returned. Set verify for writes
+        that must be checked (such as configuration): the registers are then
+        read back instead, and None is returned if they don't match."""
         LOGGER.debug(
             "Setting servo %d (register %d, value %s) ",
             address, register, data
@@ -60,17 +197,374 @@ class Protocol2Bus:
         out_bufer = [
             register % 256,
             (register >> 8),
-        ] + data
-        result = self.send_and_wait(address, 0x03, out_bufer)
+        ] + list(data)
+        if self.replies_to(address, WRITE):
+            return self.send_and_wait(address, WRITE, out_bufer)
+        if not self._send(address, WRITE, out_bufer):
+            return None
+        if verify:
+            return self._verify_write(address, register, data)
+        return []
+
+    def write_return_level(self, address, register, level):
+        """Sets the Status Return Level of a servo (register is where the
+        model keeps it) and records it in return_levels. Whether the servo
+        replies to this write depends on the old or new level, so nothing is
+        expected and the level is read back instead (unless level is
+        RETURN_PING, which stops reads being answered). Returns the same as
+        write()"""
+        LOGGER.debug("Setting return level of servo %d to %d", address, level)
+        parameters = [register % 256, register >> 8, level]
+        if not self._send(address, WRITE, parameters):
+            return None
+        self.wait_for_idle()
+        self.return_levels[address] = level
+        if level < RETURN_READ:
+            return []
+        result = self._verify_write(address, register, [level])
+        if result is None:
+            del self.return_levels[address]
         return result
 
+    def wait_for_idle(self):
+        """Discards everything arriving on the bus until nothing has arrived
+        for a whole UART timeout. Use this after an instruction that may or
+        may not be answered: the reply can take as long as the servo's
+        Return Delay Time, which the bus doesn't know, and must not be
+        mistaken for the reply to the next instruction"""
+        while self.uart.read(max(getattr(self.uart, 'in_waiting', 0), 1)):
+            pass
+        self.uart.reset_input_buffer()
+
+    def replies_to(self, address, instruction):
+        """Returns True if a servo sends a status packet in response to an
+        instruction, going by its return level"""
+        if address == BROADCAST_ADDRESS:
+            return instruction == PING
+        level = self.return_levels.get(address, RETURN_ALL)
+        if instruction == PING:
+            return True
+        if instruction in (READ, SYNC_READ, BULK_READ):
+            return level >= RETURN_READ
+        return level >= RETURN_ALL
+
+    def _verify_write(self, address, register, data):
+        """Reads back registers after a write that got no reply. Returns the
+        alarm byte as a single item list, or None if they don't match"""
+        got_data = self.read(address, register, len(data))
+        if got_data is None:
+            LOGGER.error(
+                "Could not read back register %d of servo %d",
+                register, address
+            )
+            return None
+        if list(got_data[1:]) != list(data):
+            LOGGER.error(
+                "Register %d of servo %d is %s after writing %s",
+                register, address, list(got_data[1:]), list(data)
+            )
+            return None
+        return list(got_data[:1])
+
+
+    def broadcast_ping(self):
+        """Pings every servo on the bus at once. Returns a dict mapping the
+        address of every servo that replied to its model number"""
+        LOGGER.debug("Broadcast ping")
+        found = {}
+        if not self._send(BROADCAST_ADDRESS, PING, []):
+            return found
+        while True:
+            reply = self._receive_packet(expect_reply=False)
+            if reply is None:
+                break
+            servo_id, remaining = reply
+            found[servo_id] = remaining[2] + (remaining[3] << 8)
+            if len(remaining) > 6:
+                self.firmware[servo_id] = remaining[4]
+        LOGGER.debug("Broadcast ping found %s", found)
+        return found
+
+    def sync_read(self, addresses, register, length):
+        """Reads the same registers from several servos using a single
+        instruction. Returns a dict mapping address to the data that would
+        have been returned by read() (alarm byte first). Servos that do not
+        reply are missing from the dict"""
+        addresses = self.available(addresses)
+        LOGGER.debug(
+            "Sync reading from servos %s (register %d, length %d)",
+            addresses, register, length
+        )
+        parameters = [
+            register % 256,
+            (register >> 8),
+            length % 256,
+            (length >> 8),
+        ] + addresses
+        return self._collect_replies(SYNC_READ, parameters, addresses)
+
+    def read_into(self, address, register, length, destination):
+        """Reads registers on a device, copying the data straight into
+        destination (a writable buffer such as a memoryview slice of length
+        bytes) rather than returning it. Returns the alarm byte, or None if
+        the read failed (in which case destination is untouched)"""
+        raw = self._request(address, READ, [
+            register % 256,
+            (register >> 8),
+            length % 256,
+            (length >> 8),
+        ])
+        if raw is None or len(raw) != length + 4:
+            return None
+        destination[:] = memoryview(raw)[2:-2]
+        return raw[1]
+
+    def sync_read_into(self, addresses, register, length, destinations):
+        """Like sync_read, but copies each servo's data straight into
+        destinations[address] (a writable buffer of length bytes). Returns
+        a dict mapping the address of each servo that replied to its alarm
+        byte"""
+        addresses = self.available(addresses)
+        parameters = [
+            register % 256,
+            (register >> 8),
+            length % 256,
+            (length >> 8),
+        ] + addresses
+        return self._collect_replies(
+            SYNC_READ, parameters, addresses, destinations
+        )
+
+    def bulk_read(self, requests):
+        """Reads from several servos using a single instruction. Requests is
+        a list of (address, register, length), at most one per servo.
+        Returns a dict the same as sync_read"""
+        parameters = []
+        addresses = []
+        available = self.available(request[0] for request in requests)
+        for address, register, length in requests:
+            if address not in available:
+                continue
+            addresses.append(address)
+            parameters += [
+                address,
+                register % 256,
+                (register >> 8),
+                length % 256,
+                (length >> 8),
+            ]
+        LOGGER.debug("Bulk reading %s", requests)
+        return self._collect_replies(BULK_READ, parameters, addresses)
+
+    def sync_write(self, register, length, data):
+        """Writes the same registers on several servos using a single
+        instruction. data is a dict mapping address to a list of length
+        bytes. Servos do not reply to this, so nothing is returned"""
+        LOGGER.debug(
+            "Sync writing register %d (length %d) %s", register, length, data
+        )
+        parameters = [
+            register % 256,
+            (register >> 8),
+            length % 256,
+            (length >> 8),
+        ]
+        available = self.available(data)
+        for address, values in data.items():
+            if address in available:
+                parameters += [address] + list(values)
+        if len(parameters) > 4:
+            self._send(BROADCAST_ADDRESS, SYNC_WRITE, parameters)
+
+    def bulk_write(self, writes):
+        """Writes to several servos using a single instruction. writes is a
+        list of (address, register, data), at most one per servo. Servos do
+        not reply to this, so nothing is returned"""
+        LOGGER.debug("Bulk writing %s", writes)
+        parameters = []
+        available = self.available(write[0] for write in writes)
+        for address, register, values in writes:
+            if address not in available:
+                continue
+            parameters += [
+                address,
+                register % 256,
+                (register >> 8),
+                len(values) % 256,
+                (len(values) >> 8),
+            ] + list(values)
+        if parameters:
+            self._send(BROADCAST_ADDRESS, BULK_WRITE, parameters)
+
+    def available(self, addresses):
+        """Returns the addresses in a list that the bus is still talking to
+        (those whose circuit is not open). If the retry policy's
+        probe_inline is set, this also gives one open circuit that is due a
+        probe the chance to close again"""
+        if self.retry_policy.probe_inline:
+            self.probe_open_circuits(1)
+        return [
+            address for address in addresses
+            if address not in self.health or not self.health[address].is_open
+        ]
+
+    def probe_open_circuits(self, max_probes=None):
+        """Pings servos whose circuit is open and that are due a probe.
+        At most max_probes pings are sent (all due servos if None). Returns
+        the addresses of servos that answered"""
+        now = time.monotonic()
+        recovered = []
+        for address, health in sorted(self.health.items()):
+            if max_probes is not None and max_probes <= 0:
+                break
+            if not health.probe_due(now):
+                continue
+            if max_probes is not None:
+                max_probes -= 1
+            LOGGER.debug("Probing servo %d", address)
+            health.last_attempt = now
+            if self._send_with_retries(address, PING, [], 0) is not None:
+                recovered.append(address)
+        return recovered
+
+    def reply_delay_ns(self, packet_length):
+        """Estimates how long before a status packet of packet_length bytes
+        finished arriving the servo took its reading: the time spent on the
+        wire (10 bits per byte) plus the servo's return delay"""
+        delay_ns = self.return_delay_us * 1000
+        baudrate = getattr(self.uart, 'baudrate', None)
+        if baudrate:
+            delay_ns += packet_length * 10 * 1000000000 // baudrate
+        return delay_ns
+
+    def sample_time_ns(self, address):
+        """Returns an estimate (in time.monotonic_ns() units) of when a servo
+        sampled the data in the last status packet received from it, or None
+        if nothing has been received from it"""
+        received = self.rx_times.get(address)
+        if received is None:
+            return None
+        rx_ns, packet_length = received
+        return rx_ns - self.reply_delay_ns(packet_length)
+
+    def _record_success(self, address):
+        health = self.health.get(address)
+        if health is None:
+            health = self.health[address] = ServoHealth(
+                address, self.retry_policy
+            )
+        health.record_success()
+
+    def _record_failure(self, address):
+        health = self.health.get(address)
+        if health is not None:
+            health.record_failure(time.monotonic())
+
+    def _collect_replies(self, instruction, parameters, addresses,
+                         destinations=None):
+        """Sends an instruction that multiple servos reply to and gathers
+        the replies, keyed by servo address. If destinations is given, the
+        data from each servo is copied into destinations[address] and only
+        the alarm byte is returned"""
+        replies = {}
+        if not addresses:
+            return replies
+        if self._send(BROADCAST_ADDRESS, instruction, parameters):
+            for _ in addresses:
+                reply = self._receive_packet()
+                if reply is None:
+                    break
+                servo_id, remaining = reply
+                if servo_id not in addresses:
+                    continue
+                if destinations is None:
+                    replies[servo_id] = remaining[1:-2]
+                else:
+                    destination = destinations[servo_id]
+                    if len(remaining) - 4 != len(destination):
+                        continue
+                    destination[:] = memoryview(remaining)[2:-2]
+                    replies[servo_id] = remaining[1]
+        for address in addresses:
+            if address in replies:
+                self._record_success(address)
+            else:
+                self._record_failure(address)
+        if len(replies) != len(addresses) and self.retry_policy.resync:
+            self._resync()
+        return replies
 
     def send_and_wait(self, address, instruction, parameters):
         """Sends a packet on the bus. Waits for up to max_timeout_us for
         a response. If a valid response is retrieved, it returns the servo
         error state and data as a single array (error state is the first byte
-        and is zero if no error. Otherwise it returns None"""
+        and is zero if no error. Otherwise it returns None
+
+        Failed transactions are retried according to the retry policy. If
+        the circuit to the servo is open this returns None without sending
+        anything (apart from the occasional probe)"""
+        raw = self._request(address, instruction, parameters)
+        if raw is None:
+            return None
+        return raw[1:-2]
+
+    def _request(self, address, instruction, parameters):
+        """Sends a packet to a servo, following the retry policy. Returns the
+        raw reply (everything after the header) or None"""
+        retries = self.retry_policy.retries
+        health = self.health.get(address)
+        if health is not None and health.is_open:
+            if not health.allow(time.monotonic()):
+                LOGGER.debug("Circuit to servo %d is open", address)
+                return None
+            retries = 0
+        return self._send_with_retries(address, instruction, parameters, retries)
+
+    def _send_with_retries(self, address, instruction, parameters, retries):
+        for attempt in range(retries + 1):
+            if attempt:
+                if self.retry_policy.resync:
+                    self._resync()
+                delay = self.retry_policy.backoff * (2 ** (attempt - 1))
+                if delay:
+                    time.sleep(delay)
+                LOGGER.debug("Retrying servo %d (attempt %d)", address, attempt)
+            raw = self._transact(address, instruction, parameters)
+            if raw is not None:
+                self._record_success(address)
+                return raw
+        self._record_failure(address)
+        return None
+
+    def _resync(self):
+        """Discards anything still arriving on the bus, such as a reply that
+        turned up after the timeout, so it isn't mistaken for the next one"""
+        waiting = getattr(self.uart, 'in_waiting', 0)
+        while waiting:
+            self.uart.read(waiting)
+            waiting = self.uart.in_waiting
+        self.uart.reset_input_buffer()
+
+    def _transact(self, address, instruction, parameters):
+        """Sends a packet and waits for the reply from that servo, once.
+        Returns the raw reply (see _receive_packet)"""
+        if not self._send(address, instruction, parameters):
+            return None
 
+        reply = self._receive_packet()
+        if reply is None:
+            return None
+        servo_id, remaining = reply
+        if servo_id != address:
+            LOGGER.error(
+                "Revieved packet with bad header or from incorrect servo"
+            )
+            return None
+        return remaining
+
+    def _send(self, address, instruction, parameters):
+        """Transmits a packet and checks that it was echoed back correctly.
+        Returns True if the packet went out intact"""
         self.uart.flush() # Clear buffer
         self.uart.reset_input_buffer()
         packet = self._build_packet(address, instruction, parameters)
@@ -86,10 +580,20 @@ class Protocol2Bus:
                 ' or because the timeout on the serial object did not wait'
                 ' long enough'
             )
-            return None
+            return False
+        return True
 
+    def _receive_packet(self, expect_reply=True):
+        """Reads a single status packet from the bus. Returns the ID of the
+        servo that sent it and the rest of the packet after the header
+        (instruction, error state, data and CRC), or None if no valid packet
+        arrived. The error state and data (as returned by send_and_wait) are
+        remaining[1:-2]. If expect_reply is False, silence on the bus is not
+        logged as an error"""
         rx_header = self.uart.read(7)
         LOGGER.debug("Got Header %s", rx_header)
+        if not rx_header and not expect_reply:
+            return None
         if len(rx_header) != 7:
             LOGGER.error(
                 "Recieved Header incorrect length (should be 7, got %d)",
@@ -97,7 +601,7 @@ class Protocol2Bus:
             )
             return None
 
-        if rx_header[0:5] != packet[0:5]:
+        if rx_header[0:4] != HEADER:
             LOGGER.error(
                 "Revieved packet with bad header or from incorrect servo"
             )
@@ -105,6 +609,7 @@ class Protocol2Bus:
         packet_len = rx_header[5] + (rx_header[6] << 8)
         LOGGER.debug("Expecting length %d", packet_len)
         remaining = self.uart.read(packet_len)
+        rx_ns = time.monotonic_ns()
         LOGGER.debug("Got Remaining %s (length=%d)", remaining, len(remaining))
         if len(remaining) != packet_len:
             LOGGER.error("Recieved incomplete Packet")
@@ -118,7 +623,7 @@ class Protocol2Bus:
             LOGGER.error("Incorrect CRC")
             return None
 
-        if full_packet[7] != 0x055:
+        if full_packet[7] != STATUS:
             # All packets from servos have the "instruction" 0x55
             LOGGER.error("Not a status packet")
             return None
@@ -128,7 +633,8 @@ class Protocol2Bus:
             LOGGER.error("Servo reports communication error: %d", error_byte)
             return None
 
-        return remaining[1:-2]
+        self.rx_times[rx_header[4]] = (rx_ns, len(full_packet))
+        return rx_header[4], remaining
 
     @staticmethod
     def _build_packet(address, instruction, parameters):
@@ -0,0 +1,379 @@
+"""Backing up, comparing and restoring the control tables of a fleet of
+servos.
+
+A dump holds a raw copy of every servo's control table. A profile says what
+the control tables should be, either as a raw table (such as a dump) or as
+register values in the same units used by the Servo get_/set_ functions:
+
+    {
+        "all": {"P Gain": 32, "Max Torque": 1023},
+        "servos": {
+            "3": {"registers": {"CW Angle Limit": -90}},
+            "4": {"control_table": "5e011f04..."}
+        }
+    }
+
+Restoring only writes bytes that differ from what is on the servo, merged
+into as few contiguous writes as possible, so restoring the same profile
+twice does nothing the second time."""
+import concurrent.futures
+import json
+import logging
+
+from . import protocol2, servo, servodata
+
+LOGGER = logging.getLogger(__name__)
+
+# Registers that change how the servo is addressed or answers. These are
+# written last and on their own, as the servo stops answering on the old
+# ID/baud rate, and may stop replying to writes at a new return level
+CONNECTION_REGISTERS = ('ID', 'Baud Rate', 'Return Level')
+TORQUE_ENABLE = 'Torque Enable'
+
+
+def dump_control_tables(bus, addresses=None):
+    """Reads the full control table of servos on a bus. If addresses is
+    None, the servos are found with a broadcast ping. Servos of the same
+    model are read with a single sync read. Each servo's Return Level is
+    recorded in bus.return_levels, so later writes only wait for the
+    replies it will send. Returns a dict mapping address to
+    {'model_number': .., 'control_table': bytes}"""
+    if addresses is None:
+        models = bus.broadcast_ping()
+    else:
+        models = {}
+        for address in addresses:
+            model_number = bus.ping(address)
+            if model_number is not None:
+                models[address] = model_number
+
+    by_model = {}
+    for address, model_number in sorted(models.items()):
+        by_model.setdefault(model_number, []).append(address)
+
+    dump = {}
+    for model_number, model_addresses in by_model.items():
+        descriptor = servodata.get_servo(model_number)
+        if descriptor is None:
+            LOGGER.warning(
+                "Unknown servo model %d at %s, not dumping",
+                model_number, model_addresses
+            )
+            continue
+        size = servodata.table_size(descriptor)
+        return_level = _register_address(descriptor, 'Return Level')
+        replies = bus.sync_read(model_addresses, 0, size)
+        for address in model_addresses:
+            data = replies.get(address)
+            if data is None:
+                # Fall back to reading servos that missed the sync read
+                data = bus.read(address, 0, size)
+            if data is None:
+                LOGGER.error("Failed to dump servo %d", address)
+                continue
+            dump[address] = {
+                'model_number': model_number,
+                'control_table': bytes(data[1:]),
+            }
+            if return_level is not None:
+                bus.return_levels[address] = data[1 + return_level]
+    return dump
+
+
+def encode_register(register, value):
+    """Converts a value in display units to the bytes stored in a register"""
+    if register['display']['type'] == 'bytes':
+        return bytes(value)
+    return bytes(servo.encode_value(
+        value, register['size'], register['display']
+    ))
+
+
+def target_table(current_table, descriptor, profile_entry, defaults=None):
+    """Returns the control table a servo should have. This starts from the
+    current table, with the raw control_table of the profile entry (if any)
+    laid over the writable registers, followed by the register values in
+    defaults and then those in the profile entry"""
+    target = bytearray(current_table)
+    raw = profile_entry.get('control_table')
+    if raw is not None:
+        if isinstance(raw, str):
+            raw = bytes.fromhex(raw)
+        for register in descriptor['register_map']:
+            if 'W' not in register['access'].upper():
+                continue
+            start = register['address']
+            end = start + register['size']
+            if end <= len(raw):
+                target[start:end] = raw[start:end]
+
+    values = dict(defaults or {})
+    values.update(profile_entry.get('registers', {}))
+    for name, value in values.items():
+        register = servodata.find_register(descriptor, name)
+        if register is None:
+            LOGGER.warning(
+                "%s has no register %s", descriptor['name'], name
+            )
+            continue
+        if 'W' not in register['access'].upper():
+            continue
+        start = register['address']
+        target[start:start + register['size']] = encode_register(
+            register, value
+        )
+    return target
+
+
+def diff_tables(current_table, target, descriptor):
+    """Returns a list of (register_name, current_bytes, target_bytes) for
+    every writable register whose contents differ"""
+    differences = []
+    for register in descriptor['register_map']:
+        if 'W' not in register['access'].upper():
+            continue
+        start = register['address']
+        end = start + register['size']
+        if current_table[start:end] != target[start:end]:
+            differences.append((
+                register['name'],
+                bytes(current_table[start:end]),
+                bytes(target[start:end])
+            ))
+    return differences
+
+
+def plan_writes(current_table, target, descriptor):
+    """Works out the fewest writes that turn current_table into target.
+    Returns a list of (register_address, bytes). Changed registers are
+    merged into one write if every byte between them is writable (the
+    unchanged bytes are rewritten with their current value). Writes never
+    span the EEPROM/RAM boundary (the Torque Enable register), and the
+    connection registers are always written on their own, at the end"""
+    registers = sorted(
+        (reg for reg in descriptor['register_map']
+         if 'W' in reg['access'].upper()),
+        key=lambda reg: reg['address']
+    )
+    torque = servodata.find_register(descriptor, TORQUE_ENABLE)
+    ram_start = torque['address'] if torque is not None else None
+
+    writes = []
+    last_writes = []
+    run_start = None
+    run_end = None
+    pending_end = None
+    for register in registers:
+        start = register['address']
+        end = start + register['size']
+        changed = current_table[start:end] != target[start:end]
+
+        if register['name'] in CONNECTION_REGISTERS:
+            if changed:
+                last_writes.append((start, bytes(target[start:end])))
+            breaks_run = True
+        else:
+            breaks_run = (
+                run_end is None or start != run_end
+                or (ram_start is not None and start == ram_start)
+            )
+
+        if breaks_run and pending_end is not None:
+            writes.append((run_start, bytes(target[run_start:pending_end])))
+            run_start = run_end = pending_end = None
+        if register['name'] in CONNECTION_REGISTERS:
+            continue
+
+        if run_start is None:
+            if not changed:
+                continue
+            run_start = start
+        run_end = end
+        if changed:
+            pending_end = end
+
+    if pending_end is not None:
+        writes.append((run_start, bytes(target[run_start:pending_end])))
+
+    # Baud rate goes very last: after it the servo can't hear us at all
+    last_writes.sort(key=lambda write: (
+        write[0] == _register_address(descriptor, 'Baud Rate')
+    ))
+    return writes + last_writes
+
+
+def _register_address(descriptor, name):
+    register = servodata.find_register(descriptor, name)
+    if register is None:
+        return None
+    return register['address']
+
+
+def restore_servo(bus, address, descriptor, current_table, target):
+    """Writes the differences between current_table and target to a servo.
+    EEPROM registers can only be written with the torque disabled, so if
+    any need changing the torque is switched off first, and set to the
+    target value by the very last write (after the connection registers).
+    If the baud rate changes, the torque is left off as the servo can no
+    longer be reached. Returns the number of write instructions sent, or
+    None if a write failed"""
+    current_table = bytearray(current_table)
+    writes = plan_writes(current_table, target, descriptor)
+    if not writes:
+        return 0
+
+    count = 0
+    ram_start = _register_address(descriptor, TORQUE_ENABLE)
+    final_torque = None
+    if (ram_start is not None and
+            any(start < ram_start for start, _ in writes)):
+        if current_table[ram_start]:
+            if bus.write(address, ram_start, [0]) is None:
+                LOGGER.error("Failed to disable torque on servo %d", address)
+                return None
+            count += 1
+            current_table[ram_start] = 0
+        # Leave the torque out of the plan and set it once everything else
+        # has been written
+        target = bytearray(target)
+        if target[ram_start] != current_table[ram_start]:
+            final_torque = target[ram_start]
+        target[ram_start] = current_table[ram_start]
+        writes = plan_writes(current_table, target, descriptor)
+
+    id_address = _register_address(descriptor, 'ID')
+    baud_address = _register_address(descriptor, 'Baud Rate')
+    return_level_address = _register_address(descriptor, 'Return Level')
+    for start, data in writes:
+        LOGGER.info(
+            "Writing %d bytes at %d to servo %d", len(data), start, address
+        )
+        if start in (id_address, baud_address):
+            # The reply (if any) comes from the new ID or at the new baud
+            bus.send_blind(
+                address, protocol2.WRITE, [start % 256, start >> 8] + list(data)
+            )
+            bus.wait_for_idle()
+            if start == id_address:
+                if bus.ping(data[0]) is None:
+                    LOGGER.error(
+                        "Servo %d did not answer after changing its ID to %d",
+                        address, data[0]
+                    )
+                    return None
+                address = data[0]
+        elif start == return_level_address:
+            if bus.write_return_level(address, start, data[0]) is None:
+                LOGGER.error("Failed to set return level of servo %d", address)
+                return None
+        elif bus.write(
+                address, start, list(data),
+                verify=ram_start is None or start < ram_start
+        ) is None:
+            LOGGER.error("Failed to write to servo %d", address)
+            return None
+        count += 1
+
+    if final_torque is not None:
+        if baud_address in (start for start, _ in writes):
+            LOGGER.warning(
+                "Servo %d changed baud rate, leaving its torque off", address
+            )
+        elif bus.write(address, ram_start, [final_torque]) is None:
+            LOGGER.error("Failed to restore torque on servo %d", address)
+            return None
+        else:
+            count += 1
+    return count
+
+
+def _profile_entry(profile, address):
+    servos = profile.get('servos', {})
+    return servos.get(str(address), servos.get(address, {}))
+
+
+def diff_bus(bus, profile, dump=None):
+    """Compares the servos on a bus against a profile. Returns a dict
+    mapping address to the output of diff_tables. Servos with no
+    differences are left out"""
+    if dump is None:
+        dump = dump_control_tables(bus)
+    differences = {}
+    for address, entry in sorted(dump.items()):
+        descriptor = servodata.get_servo(entry['model_number'])
+        target = target_table(
+            entry['control_table'], descriptor,
+            _profile_entry(profile, address), profile.get('all')
+        )
+        servo_diff = diff_tables(entry['control_table'], target, descriptor)
+        if servo_diff:
+            differences[address] = servo_diff
+    return differences
+
+
+def restore_bus(bus, profile, dump=None):
+    """Makes the servos on a bus match a profile. Returns a dict mapping
+    address to the number of writes performed (None where it failed)"""
+    if dump is None:
+        dump = dump_control_tables(bus)
+    results = {}
+    for address, entry in sorted(dump.items()):
+        descriptor = servodata.get_servo(entry['model_number'])
+        target = target_table(
+            entry['control_table'], descriptor,
+            _profile_entry(profile, address), profile.get('all')
+        )
+        results[address] = restore_servo(
+            bus, address, descriptor, entry['control_table'], target
+        )
+    return results
+
+
+def run_on_buses(function, buses, *args):
+    """Runs function(bus, *args) on each bus in parallel (one thread per
+    bus, as each bus is an independent serial port). Returns a list of the
+    results in the same order as buses"""
+    buses = list(buses)
+    if len(buses) <= 1:
+        return [function(bus, *args) for bus in buses]
+    with concurrent.futures.ThreadPoolExecutor(len(buses)) as executor:
+        futures = [executor.submit(function, bus, *args) for bus in buses]
+        return [future.result() for future in futures]
+
+
+def dump_to_json(dump):
+    """Converts the output of dump_control_tables to something that can be
+    stored with json. The result can be used directly as a profile"""
+    servos = {}
+    for address, entry in sorted(dump.items()):
+        descriptor = servodata.get_servo(entry['model_number'])
+        table = entry['control_table']
+        decoded = {}
+        for register in descriptor['register_map']:
+            start = register['address']
+            value = servo.format_data(
+                table[start:start + register['size']], register['display']
+            )
+            if isinstance(value, (bytes, bytearray)):
+                value = list(value)
+            decoded[register['name']] = value
+        servos[str(address)] = {
+            'model_number': entry['model_number'],
+            'name': descriptor['name'],
+            'control_table': table.hex(),
+            # Only for reading: restoring uses the raw control_table
+            'decoded': decoded,
+        }
+    return {'servos': servos}
+
+
+def save(data, file_name):
+    """Writes a dump or profile to a json file"""
+    with open(file_name, 'w') as out_file:
+        json.dump(data, out_file, indent=2, sort_keys=True)
+
+
+def load(file_name):
+    """Reads a dump or profile from a json file"""
+    with open(file_name) as in_file:
+        return json.load(in_file)
@@ -0,0 +1,55 @@
+"""Sets the Status Return Level of every servo on a bus.
+
+    returnlevel.set_bus_return_level(bus, protocol2.RETURN_READ)
+
+At RETURN_READ servos only reply to pings and reads, so the bus sends
+writes to them without waiting for a status packet (see
+Protocol2Bus.replies_to), which takes about half as long. Configuration
+writes are still checked by reading the registers back."""
+import logging
+
+from . import servodata
+
+LOGGER = logging.getLogger(__name__)
+
+RETURN_LEVEL = 'Return Level'
+
+
+def set_bus_return_level(bus, level, addresses=None):
+    """Sets the return level of every servo on a bus (or just those at
+    addresses, which are found with a broadcast ping otherwise), recording
+    it in bus.return_levels. Returns True if every servo was set. Raises
+    ValueError (before changing anything) if a servo has no Return Level
+    register"""
+    if addresses is None:
+        found = bus.broadcast_ping()
+    else:
+        found = {}
+        for address in addresses:
+            model_number = bus.ping(address)
+            if model_number is not None:
+                found[address] = model_number
+    if not found:
+        LOGGER.error("No servos found")
+        return False
+
+    registers = {}
+    for address, model_number in sorted(found.items()):
+        descriptor = servodata.get_servo(model_number)
+        register = None
+        if descriptor is not None:
+            register = servodata.find_register(descriptor, RETURN_LEVEL)
+        if register is None:
+            raise ValueError(
+                "Servo {} (model {}) has no {} register".format(
+                    address, model_number, RETURN_LEVEL
+                )
+            )
+        registers[address] = register['address']
+
+    success = True
+    for address, register in registers.items():
+        if bus.write_return_level(address, register, level) is None:
+            LOGGER.error("Failed to set return level of servo %d", address)
+            success = False
+    return success
@@ -0,0 +1,249 @@
+"""Shares a bus between fast control traffic and slow housekeeping.
+
+The scheduler runs a fixed cycle. Every cycle all CONTROL tasks run. Lower
+priority tasks (TELEMETRY, then HOUSEKEEPING) only run if their expected
+duration fits into what is left of the cycle's time budget, so they fill the
+slack without delaying control. Tasks that don't fit are tried first next
+cycle, so every task in a class gets its turn (round-robin). Each time a
+task is skipped its estimate is lowered, so a task that once ran slowly is
+tried again eventually rather than being skipped forever.
+
+    scheduler = BusScheduler(bus, cycle_time=0.01)
+    scheduler.add_write_buffer(write_buffer)
+    scheduler.add_group_read(servos, 'Present Position', store, CONTROL)
+    scheduler.add_group_read(servos, 'Present Temperature', log, HOUSEKEEPING)
+    scheduler.add_hardware_monitor(servos)
+    scheduler.add_circuit_probe()
+    scheduler.start()
+
+While the scheduler is running in the background, it should be the only
+thing using the bus."""
+import collections
+import logging
+import threading
+import time
+
+from . import servo as servo_module
+from . import servodata
+
+LOGGER = logging.getLogger(__name__)
+
+CONTROL = 0
+TELEMETRY = 1
+HOUSEKEEPING = 2
+PRIORITY_NAMES = {
+    CONTROL: 'control',
+    TELEMETRY: 'telemetry',
+    HOUSEKEEPING: 'housekeeping',
+}
+
+# How quickly the estimate of a task's duration follows new measurements
+ESTIMATE_WEIGHT = 0.25
+# How much a task's estimate is lowered each time it is skipped
+SKIP_DECAY = 0.75
+
+
+class Task:
+    """A unit of bus traffic. function is called with no arguments.
+    estimate is the expected run time in seconds, learnt from previous
+    runs"""
+    def __init__(self, function, priority, name=None):
+        self.function = function
+        self.priority = priority
+        self.name = name or getattr(function, '__name__', repr(function))
+        self.estimate = 0.0
+        self.runs = 0
+        self.skips = 0
+
+    def run(self):
+        """Runs the task, returning how long it took"""
+        start = time.monotonic()
+        try:
+            self.function()
+        except Exception:  # A broken task shouldn't stop the others
+            LOGGER.exception("Scheduled task %s failed", self.name)
+        elapsed = time.monotonic() - start
+        if self.runs == 0:
+            self.estimate = elapsed
+        else:
+            self.estimate += (elapsed - self.estimate) * ESTIMATE_WEIGHT
+        self.runs += 1
+        return elapsed
+
+    def skip(self):
+        """Records that the task did not fit into a cycle. Its estimate
+        is lowered so that it gets another chance, even if it once took
+        longer than the whole budget"""
+        self.skips += 1
+        self.estimate *= SKIP_DECAY
+
+    def __repr__(self):
+        return "Task {} ({})".format(
+            self.name, PRIORITY_NAMES.get(self.priority, self.priority)
+        )
+
+
+class BusScheduler:
+    """Runs tasks on a bus in cycles of cycle_time seconds. budget is how
+    much of each cycle may be spent on bus traffic (defaults to the whole
+    cycle). See the module docstring for how tasks are chosen"""
+    def __init__(self, bus, cycle_time=0.01, budget=None):
+        self.bus = bus
+        self.cycle_time = cycle_time
+        self.budget = cycle_time if budget is None else budget
+        self.cycles = 0
+        self.overruns = 0
+        self.last_report = {}
+        self._queues = collections.defaultdict(collections.deque)
+        self._totals = collections.defaultdict(float)
+        self._thread = None
+        self._running = False
+
+    def add_task(self, function, priority=HOUSEKEEPING, name=None):
+        """Adds a function to be run by the scheduler. Returns the Task"""
+        task = Task(function, priority, name)
+        self._queues[priority].append(task)
+        return task
+
+    def remove_task(self, task):
+        """Stops running a task"""
+        self._queues[task.priority].remove(task)
+
+    def add_read(self, servo, register_name, callback, priority=TELEMETRY):
+        """Reads a register from a single servo, calling callback(servo,
+        value) with the result (value is None if the read failed)"""
+        getter = servo.__dict__[
+            servo_module.format_register_name(register_name, True)
+        ]
+
+        def read():
+            callback(servo, getter())
+        return self.add_task(
+            read, priority, "{} {}".format(servo.address, register_name)
+        )
+
+    def add_group_read(self, servos, register_name, callback,
+                       priority=TELEMETRY):
+        """Reads the same register from several servos with one sync read,
+        calling callback({servo: value}) with the results. Servos that did
+        not answer are left out. All the servos must be the same model"""
+        servos = list(servos)
+        register = servodata.find_register(servos[0].data, register_name)
+        by_address = {serv.address: serv for serv in servos}
+
+        def read():
+            replies = self.bus.sync_read(
+                list(by_address), register['address'], register['size']
+            )
+            values = {}
+            for address, data in replies.items():
+                serv = by_address[address]
+                serv._check_hardware_error(data[0])
+                values[serv] = servo_module.format_data(
+                    data[1:], register['display']
+                )
+            callback(values)
+        return self.add_task(read, priority, "group {}".format(register_name))
+
+    def add_write_buffer(self, write_buffer, priority=CONTROL):
+        """Commits a writebuffer.WriteBuffer every cycle"""
+        return self.add_task(write_buffer.commit, priority, "write buffer")
+
+    def add_circuit_probe(self, max_probes=1, priority=HOUSEKEEPING):
+        """Gives servos the bus has stopped talking to (see
+        protocol2.RetryPolicy) the chance to come back, by pinging up to
+        max_probes of those due a probe each time the task runs"""
+        return self.add_task(
+            lambda: self.bus.probe_open_circuits(max_probes), priority,
+            "circuit probe"
+        )
+
+    def add_hardware_monitor(self, servos, priority=HOUSEKEEPING):
+        """Polls the hardware error status of each servo (one task per
+        servo, so they take turns), running the servo's on_hardware_error
+        callbacks if a problem is found"""
+        return [
+            self.add_task(
+                serv.poll_hardware_error, priority,
+                "{} hardware error".format(serv.address)
+            )
+            for serv in servos
+        ]
+
+    def run_cycle(self):
+        """Runs a single cycle of tasks. Returns a report of how the budget
+        was used: a dict mapping each priority name to {'used': seconds,
+        'fraction': share of the budget, 'runs': tasks run, 'skipped':
+        tasks that did not fit}"""
+        start = time.monotonic()
+        report = {}
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            used = 0.0
+            runs = 0
+            skipped = []
+            for _ in range(len(queue)):
+                task = queue.popleft()
+                remaining = self.budget - (time.monotonic() - start)
+                if priority != CONTROL and task.estimate > remaining:
+                    task.skip()
+                    skipped.append(task)
+                    continue
+                used += task.run()
+                runs += 1
+                queue.append(task)
+            # Tasks that missed out go to the front for the next cycle
+            queue.extendleft(reversed(skipped))
+            self._totals[priority] += used
+            report[PRIORITY_NAMES.get(priority, priority)] = {
+                'used': used,
+                'fraction': used / self.budget if self.budget else 0.0,
+                'runs': runs,
+                'skipped': len(skipped),
+            }
+
+        self.cycles += 1
+        if time.monotonic() - start > self.budget:
+            self.overruns += 1
+        self.last_report = report
+        return report
+
+    def usage(self):
+        """Returns the average time per cycle spent on each priority class
+        since the scheduler was created, as a fraction of the budget"""
+        if not self.cycles or not self.budget:
+            return {}
+        return {
+            PRIORITY_NAMES.get(priority, priority):
+                total / self.cycles / self.budget
+            for priority, total in self._totals.items()
+        }
+
+    def run(self, cycles=None):
+        """Runs cycles back to back at the cycle rate, forever (or until
+        stop() is called) if cycles is None"""
+        self._running = True
+        next_cycle = time.monotonic()
+        while self._running and (cycles is None or cycles > 0):
+            self.run_cycle()
+            if cycles is not None:
+                cycles -= 1
+            next_cycle += self.cycle_time
+            delay = next_cycle - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running late, don't try and catch up
+                next_cycle = time.monotonic()
+
+    def start(self):
+        """Runs the scheduler in a background thread"""
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the scheduler after the current cycle"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
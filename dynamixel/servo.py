@@ -18,17 +18,32 @@ class Servo:
     This class also contains a list "on_hardware_error" which can contain
     callbacks to run when the servo reports a hardware error over it's status
     packet from a normal read/write.
+
+    If write_buffer is set (see writebuffer.WriteBuffer.attach), set_*
+    functions record the value in the buffer instead of writing it.
+
+    The servo keeps the bus informed of its Return Level whenever it is
+    read or set, so that writes don't wait for replies that won't come.
+    Configuration writes (see is_configuration) are still checked.
     """
     def __init__(self, bus, address, descriptor=None):
         self.bus = bus
         self.address = address
         self.data = descriptor
+        self.write_buffer = None
 
         self.on_hardware_error = list()
 
+        # Registers before Torque Enable are stored in EEPROM
+        self._eeprom_end = 0
+        self._return_level_register = None
 
         if self.data is not None:
             for register in self.data['register_map']:
+                if register['name'] == 'Torque Enable':
+                    self._eeprom_end = register['address']
+                if register['name'] == 'Return Level':
+                    self._return_level_register = register['address']
                 get_name = format_register_name(register['name'], True)
                 set_name = format_register_name(register['name'], False)
                 if 'R' in register['access'].upper():
@@ -57,6 +72,8 @@ class Servo:
             return None
 
         self._check_hardware_error(got_data[0])
+        if register == self._return_level_register:
+            self.bus.return_levels[self.address] = got_data[1]
         return format_data(got_data[1:], display_info)
 
     def _check_hardware_error(self, byte):
@@ -67,7 +84,33 @@ class Servo:
             LOGGER.warning("Hardware error on servo %d", self.address)
             for funct in self.on_hardware_error:
                 funct(self)
-                
+
+    def poll_hardware_error(self):
+        """Reads the Hardware Error Status register and runs the
+        on_hardware_error callbacks if either it or the alarm bit of the
+        reply indicate a problem. Returns the error status (0 if there is
+        none), or None if the servo could not be read"""
+        register = None
+        if self.data is not None:
+            for reg in self.data['register_map']:
+                if reg['name'] == 'Hardware Error Status':
+                    register = reg
+        if register is None:
+            # No error register, but the alarm bit still says something
+            got_data = self.bus.read(self.address, 0, 1)
+        else:
+            got_data = self.bus.read(
+                self.address, register['address'], register['size']
+            )
+        if got_data is None:
+            return None
+
+        status = 0
+        for pos, byte in enumerate(got_data[1:] if register else []):
+            status += byte << (8 * pos)
+        self._check_hardware_error(got_data[0] or status)
+        return status
+
     def get_register_data(self):
         """Returns a dict of data about the registers this servo has"""
         if self.data is not None:
@@ -77,11 +120,19 @@ class Servo:
 
     def set_register(self, register, length, display_info, value):
         """Returns True if succeeded, None if failed"""
-        data_to_write = [0x00] * length
-        formatted_data = format_data_inverse(value, display_info)
-        for pos, data in enumerate(formatted_data):
-            data_to_write[-pos] = data
-        result = self.bus.write(self.address, register, data_to_write)
+        data_to_write = encode_value(value, length, display_info)
+        configuration = self.is_configuration(register)
+        if self.write_buffer is not None and not configuration:
+            self.write_buffer.set(self.address, register, data_to_write)
+            return True
+        if register == self._return_level_register:
+            result = self.bus.write_return_level(
+                self.address, register, data_to_write[0]
+            )
+        else:
+            result = self.bus.write(
+                self.address, register, data_to_write, verify=configuration
+            )
         if result is None:
             LOGGER.error(
                 "Failed to set register %d of servo %d",
@@ -89,9 +140,19 @@ class Servo:
             )
             return None
 
-        self._check_hardware_error(result[0])
+        if result:
+            self._check_hardware_error(result[0])
         return True
 
+    def is_configuration(self, register):
+        """Returns True if a register holds configuration (it is in EEPROM,
+        or is the Return Level). Writes to these are always sent straight
+        away and checked, even if nothing else gets a reply"""
+        return (
+            register < self._eeprom_end
+            or register == self._return_level_register
+        )
+
     def ping(self):
         """Returns True if the ping succeeds, otherwise it returns False"""
         return self.bus.ping(self.address) is not None
@@ -123,6 +184,9 @@ def format_data(data, display_info):
     for pos, byte in enumerate(data):
         combined += byte << (8*pos)
 
+    if display_info.get('signed') and data and combined >> (8*len(data) - 1):
+        combined -= 1 << (8*len(data))
+
     combined = convert_value(combined, display_info)
 
     if display_info['type'] == 'int':
@@ -161,9 +225,26 @@ def format_data_inverse(data, display_info):
         
     value = convert_value_inverse(value, display_info)
 
+    if display_info.get('signed'):
+        # Two's complement, with room for the sign bit. encode_value
+        # extends it to the size of the register
+        return list(value.to_bytes(value.bit_length() // 8 + 1, 'little',
+                                   signed=True))
     return list(value.to_bytes(math.floor((value.bit_length() + 7) / 8), 'little'))
 
 
+def encode_value(value, length, display_info):
+    """Returns the length bytes to write to a register to set it to value
+    (see format_data_inverse)"""
+    formatted_data = format_data_inverse(value, display_info)
+    fill = 0x00
+    if display_info.get('signed') and formatted_data[-1] & 0x80:
+        fill = 0xFF
+    data = [fill] * length
+    data[:len(formatted_data)] = formatted_data[:length]
+    return data
+
+
 def convert_value(val, display_info):
     if "offset" in display_info:
         val -= display_info['offset']
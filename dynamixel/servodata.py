@@ -25,4 +25,39 @@ def load_database(directory):
             SERVO_DATA[raw_data['model_number']] = raw_data
 
 
+def find_register(descriptor, name):
+    """Returns the register from a servo description with the specified
+    name, or None if the servo does not have it"""
+    for register in descriptor['register_map']:
+        if register['name'] == name:
+            return register
+    return None
+
+
+def table_size(descriptor):
+    """Returns the number of bytes spanned by a servo's register map"""
+    return max(
+        register['address'] + register['size']
+        for register in descriptor['register_map']
+    )
+
+
+def baud_rate_value(descriptor, baud_rate):
+    """Returns the value of the Baud Rate register that selects a baud
+    rate, or None if the servo does not support it"""
+    rates = descriptor.get('baud_rates', [])
+    if baud_rate in rates:
+        return rates.index(baud_rate)
+    return None
+
+
+def baud_rate_from_value(descriptor, value):
+    """Returns the baud rate selected by a Baud Rate register value, or
+    None if it is not known"""
+    rates = descriptor.get('baud_rates', [])
+    if 0 <= value < len(rates):
+        return rates[value]
+    return None
+
+
 load_database(SERVO_DIRECTORY)
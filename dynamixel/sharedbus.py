@@ -0,0 +1,207 @@
+"""Lets several threads use one bus safely.
+
+A Protocol2Bus can only do one thing at a time: if two threads talk on it
+at once, they get each other's replies. A SharedBus owns the bus and runs
+every request on a single thread of its own. Other threads submit requests
+and get a concurrent.futures.Future back:
+
+    shared = SharedBus(bus)
+    shared.start()
+    position = shared.read(2, 37, 2)
+    shared.write(2, 30, [0, 2]).result()
+    print(position.result())
+
+Requests that are waiting when the bus thread gets to them are combined:
+identical reads are only done once, and reads of the same registers from
+several servos become one sync read. view() returns an object with the
+same blocking API as Protocol2Bus, so Servo objects in any thread can use
+the shared bus:
+
+    serv = servo.Servo(shared.view(), 2, servodata.get_servo(350))
+"""
+import concurrent.futures
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Request:
+    """A request waiting for the bus thread. Reads have a key of (address,
+    register, length); everything else is a call of function(bus, *args)"""
+    def __init__(self, future, key=None, function=None, args=(), kwargs=None):
+        self.future = future
+        self.key = key
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+
+
+class SharedBus:
+    """Runs requests on a bus from a single thread (see module docstring).
+    gather_time is how long the bus thread waits after the first request
+    arrives for others to combine with it. group_reads can be cleared for
+    servos that don't support sync read"""
+    def __init__(self, bus, gather_time=0.0, group_reads=True):
+        self.bus = bus
+        self.gather_time = gather_time
+        self.group_reads = group_reads
+        self._pending = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts the bus thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the bus thread. Requests that haven't run are cancelled"""
+        with self._condition:
+            self._running = False
+            pending = self._pending
+            self._pending = []
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for request in pending:
+            request.future.cancel()
+
+    def read(self, address, register, length):
+        """Queues a read. The future's result is what Protocol2Bus.read
+        would return"""
+        return self._queue(_Request(
+            concurrent.futures.Future(), key=(address, register, length)
+        ))
+
+    def write(self, address, register, data, verify=False):
+        """Queues a write. The future's result is what Protocol2Bus.write
+        would return"""
+        return self.submit(
+            type(self.bus).write, address, register, data, verify=verify
+        )
+
+    def ping(self, address):
+        """Queues a ping. The future's result is the model number or None"""
+        return self.submit(type(self.bus).ping, address)
+
+    def submit(self, function, *args, **kwargs):
+        """Queues function(bus, *args, **kwargs) to run on the bus thread,
+        returning a future for its result"""
+        return self._queue(_Request(
+            concurrent.futures.Future(), function=function, args=args,
+            kwargs=kwargs
+        ))
+
+    def view(self):
+        """Returns a BusView of this shared bus"""
+        return BusView(self)
+
+    def _queue(self, request):
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        return request.future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                if self.gather_time:
+                    self._condition.wait(self.gather_time)
+                batch = self._pending
+                self._pending = []
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        """Runs a list of requests in order, combining neighbouring reads"""
+        reads = []
+        for request in batch:
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            if request.key is not None:
+                reads.append(request)
+                continue
+            # Reads queued before a call happen before it
+            self._run_reads(reads)
+            reads = []
+            try:
+                request.future.set_result(request.function(
+                    self.bus, *request.args, **request.kwargs
+                ))
+            except Exception as err:  # Report it to the caller
+                request.future.set_exception(err)
+        self._run_reads(reads)
+
+    def _run_reads(self, reads):
+        """Does a list of reads, only reading each block of each servo once
+        and reading the same block from several servos with a sync read"""
+        if not reads:
+            return
+        waiting = {}
+        for request in reads:
+            waiting.setdefault(request.key, []).append(request.future)
+
+        results = {}
+        error = None
+        blocks = {}
+        for address, register, length in waiting:
+            blocks.setdefault((register, length), []).append(address)
+        try:
+            for (register, length), addresses in blocks.items():
+                if self.group_reads and len(addresses) > 1:
+                    replies = self.bus.sync_read(addresses, register, length)
+                    for address, data in replies.items():
+                        results[(address, register, length)] = data
+                for address in addresses:
+                    key = (address, register, length)
+                    if key not in results:
+                        results[key] = self.bus.read(address, register, length)
+        except Exception as err:  # Report it to the callers still waiting
+            error = err
+
+        for key, futures in waiting.items():
+            for future in futures:
+                if key in results:
+                    future.set_result(results[key])
+                else:
+                    future.set_exception(error)
+
+
+class BusView:
+    """Looks like a Protocol2Bus, but every call is run on a SharedBus's
+    thread (blocking until it is done). Attributes that aren't methods,
+    such as return_levels, are those of the underlying bus"""
+    def __init__(self, shared_bus):
+        self.shared_bus = shared_bus
+
+    def read(self, address, register, length):
+        """See Protocol2Bus.read"""
+        return self.shared_bus.read(address, register, length).result()
+
+    def write(self, address, register, data, verify=False):
+        """See Protocol2Bus.write"""
+        return self.shared_bus.write(
+            address, register, data, verify=verify
+        ).result()
+
+    def ping(self, address):
+        """See Protocol2Bus.ping"""
+        return self.shared_bus.ping(address).result()
+
+    def __getattr__(self, name):
+        bus = self.__dict__['shared_bus'].bus
+        attribute = getattr(bus, name)
+        if not callable(attribute):
+            return attribute
+        function = getattr(type(bus), name)
+
+        def call(*args, **kwargs):
+            return self.shared_bus.submit(function, *args, **kwargs).result()
+        return call
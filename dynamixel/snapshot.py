@@ -0,0 +1,101 @@
+"""Time-aligned state of a group of servos.
+
+Servos in a group are read one after another, so each reading was taken at
+a slightly different time. A Snapshot keeps the time each servo's values
+were sampled (as estimated by the bus), and given the snapshot before it can
+work out what every servo's values were at one common time:
+
+    previous = None
+    while True:
+        mirror.refresh(bus, ['Present Position'])
+        snap = mirror.snapshot(['Present Position'], previous)
+        positions = snap.at(snap.reference_ns)
+        speeds = snap.rates()
+        previous = snap
+"""
+import numbers
+
+
+class Snapshot:
+    """values maps servo address to {register_name: value}, sample_ns maps
+    servo address to when those values were sampled (time.monotonic_ns()
+    units). previous is an earlier Snapshot of the same servos, used for
+    interpolation and extrapolation"""
+    def __init__(self, values, sample_ns, previous=None):
+        self.values = values
+        self.sample_ns = sample_ns
+        self.previous = previous
+        if previous is not None:
+            # Only one level of history is needed
+            previous.previous = None
+
+    @property
+    def reference_ns(self):
+        """The latest sample time in the snapshot. Aligning to this time
+        never extrapolates further than the spread of the readings"""
+        times = [
+            stamp for stamp in self.sample_ns.values() if stamp is not None
+        ]
+        return max(times) if times else None
+
+    @property
+    def spread_ns(self):
+        """How far apart the first and last readings were taken"""
+        times = [
+            stamp for stamp in self.sample_ns.values() if stamp is not None
+        ]
+        return max(times) - min(times) if times else 0
+
+    def value_at(self, address, name, time_ns):
+        """Estimates the value of a register of a servo at time_ns by
+        drawing a straight line through this snapshot's and the previous
+        snapshot's readings. Values that aren't numbers (or that have no
+        previous reading) are returned unchanged"""
+        value = self.values[address][name]
+        rate = self.rate(address, name)
+        if rate is None:
+            return value
+        return value + rate * (time_ns - self.sample_ns[address]) / 1e9
+
+    def rate(self, address, name):
+        """Returns the rate of change of a register of a servo, per second,
+        between the previous snapshot and this one, or None if it can't be
+        worked out"""
+        if self.previous is None:
+            return None
+        value = self.values.get(address, {}).get(name)
+        old_value = self.previous.values.get(address, {}).get(name)
+        if not _is_number(value) or not _is_number(old_value):
+            return None
+        new_ns = self.sample_ns.get(address)
+        old_ns = self.previous.sample_ns.get(address)
+        if new_ns is None or old_ns is None or new_ns == old_ns:
+            return None
+        return (value - old_value) * 1e9 / (new_ns - old_ns)
+
+    def at(self, time_ns=None):
+        """Returns {address: {register_name: value}} with every value
+        estimated at the same time (reference_ns by default)"""
+        if time_ns is None:
+            time_ns = self.reference_ns
+        return {
+            address: {
+                name: self.value_at(address, name, time_ns)
+                for name in registers
+            }
+            for address, registers in self.values.items()
+        }
+
+    def rates(self):
+        """Returns {address: {register_name: rate per second}} for every
+        numeric register (see rate)"""
+        return {
+            address: {
+                name: self.rate(address, name) for name in registers
+            }
+            for address, registers in self.values.items()
+        }
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
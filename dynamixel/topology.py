@@ -0,0 +1,145 @@
+"""Remembers which servos were found on each bus, so that starting up on a
+known robot doesn't need a full scan.
+
+Scanning a bus pings every address, and each address without a servo costs
+a full UART timeout. The topology cache stores, for each port and baud
+rate, the ID, model number and firmware version of every servo found last
+time. discover() checks just those servos and only falls back to a full
+scan if they don't match:
+
+    servos = topology.discover(bus, '/dev/ttyUSB0', 1000000)
+    for address, info in servos.items():
+        print(address, servodata.get_servo(info['model_number'])['name'])
+
+Checking uses targeted pings by default, which take no longer than the
+replies themselves when every servo is present but can't see servos that
+have been added. A broadcast ping sees those too, at the cost of waiting
+for one UART timeout."""
+import json
+import logging
+import os
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_ADDRESS = 253
+
+
+def default_cache_path():
+    """Returns where the topology cache is kept: topology.json in a
+    dynamixel folder in the user's cache directory"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(cache_home, 'dynamixel', 'topology.json')
+
+
+def servo_info(model_number, firmware):
+    """Returns the information kept about a servo"""
+    return {'model_number': model_number, 'firmware': firmware}
+
+
+class TopologyCache:
+    """The servos last seen on each bus, kept in a JSON file. The file is
+    read when the cache is created and written by save()"""
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        self.buses = {}
+        try:
+            with open(self.path) as cache_file:
+                self.buses = json.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            LOGGER.warning("Ignoring unreadable topology cache %s: %s",
+                           self.path, err)
+
+    @staticmethod
+    def key(port, baud):
+        """Returns the key a bus is stored under"""
+        return "{}@{}".format(port, baud)
+
+    def get(self, port, baud):
+        """Returns {address: servo_info} for the servos last seen on a bus,
+        or None if the bus is not in the cache"""
+        servos = self.buses.get(self.key(port, baud))
+        if servos is None:
+            return None
+        return {int(address): info for address, info in servos.items()}
+
+    def put(self, port, baud, servos):
+        """Stores {address: servo_info} for a bus"""
+        self.buses[self.key(port, baud)] = {
+            str(address): info for address, info in sorted(servos.items())
+        }
+
+    def forget(self, port, baud):
+        """Removes a bus from the cache"""
+        self.buses.pop(self.key(port, baud), None)
+
+    def save(self):
+        """Writes the cache to its file. Returns True if it succeeded"""
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(temp_path, 'w') as cache_file:
+                json.dump(self.buses, cache_file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as err:
+            LOGGER.warning("Failed to save topology cache %s: %s",
+                           self.path, err)
+            return False
+        return True
+
+
+def scan(bus, addresses=range(MAX_ADDRESS)):
+    """Pings every address. Returns {address: servo_info} for the servos
+    that answered"""
+    servos = {}
+    for address in addresses:
+        model_number = bus.ping(address)
+        if model_number is not None:
+            servos[address] = servo_info(
+                model_number, bus.firmware.get(address)
+            )
+    return servos
+
+
+def check(bus, servos, broadcast=False):
+    """Returns True if the servos on the bus are exactly those in
+    {address: servo_info}, with the same models and firmware. This uses a
+    ping to each servo or, if broadcast is set, a single broadcast ping"""
+    if broadcast:
+        found = bus.broadcast_ping()
+        if set(found) != set(servos):
+            return False
+    else:
+        found = {}
+        for address in servos:
+            model_number = bus.ping(address)
+            if model_number is None:
+                return False
+            found[address] = model_number
+    return all(
+        found[address] == info['model_number']
+        and bus.firmware.get(address) == info['firmware']
+        for address, info in servos.items()
+    )
+
+
+def discover(bus, port, baud, cache=None, broadcast=False):
+    """Returns {address: servo_info} for the servos on a bus. If the servos
+    cached for the port and baud rate are all there (see check), they are
+    returned without scanning. Otherwise the bus is scanned and the cache
+    updated. cache defaults to a TopologyCache at the default path"""
+    if cache is None:
+        cache = TopologyCache()
+    known = cache.get(port, baud)
+    if known and check(bus, known, broadcast):
+        LOGGER.info("Servos on %s at %d match the topology cache", port, baud)
+        return known
+
+    LOGGER.info("Scanning %s at %d", port, baud)
+    servos = scan(bus)
+    cache.put(port, baud, servos)
+    cache.save()
+    return servos
@@ -0,0 +1,223 @@
+"""A hardware-free benchmark for the protocol and servo layers. Everything
+runs against the in-process FakeUart, so the numbers measure the CPU cost of
+this library. Bus cycle benchmarks also add the modelled time the traffic
+would spend on the wire at each of the XL-320 baud rates.
+
+Results are written as JSON. Passing --compare with a previous result file
+flags any metric that got worse by more than --threshold and exits non-zero
+so that it can be used from CI:
+
+    python -m dynamixel.utils.benchmark --output before.json
+    python -m dynamixel.utils.benchmark --compare before.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .. import lean, protocol2, servo, servodata
+from . import fakebus
+
+XL320_BAUDS = [9600, 57600, 115200, 1000000]
+DEFAULT_SERVO_COUNT = 8
+DEFAULT_THRESHOLD = 0.1
+
+
+def _best_time(function, iterations, repeat):
+    """Returns the fastest time per call of function over repeat runs of
+    iterations calls each"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        elapsed = (time.perf_counter() - start) / iterations
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _metric(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def bench_crc(iterations, repeat):
+    """CRC of a typical short packet"""
+    data = list(range(12))
+    per_call = _best_time(lambda: protocol2.crc16(data), iterations, repeat)
+    return {'crc16': _metric(1 / per_call, 'calls/s', 'higher')}
+
+
+def bench_build_packet(iterations, repeat):
+    """Building a write packet"""
+    build = protocol2.Protocol2Bus._build_packet
+    per_call = _best_time(
+        lambda: build(1, 0x03, [30, 0, 0, 2]), iterations, repeat
+    )
+    return {'build_packet': _metric(1 / per_call, 'packets/s', 'higher')}
+
+
+def bench_round_trip(iterations, repeat):
+    """A read of one register through send_and_wait"""
+    bus = protocol2.Protocol2Bus(fakebus.make_uart([1]))
+    per_call = _best_time(lambda: bus.read(1, 37, 2), iterations, repeat)
+    lean_bus = lean.Protocol2Bus(fakebus.make_uart([1]))
+    lean_call = _best_time(lambda: lean_bus.read(1, 37, 2), iterations, repeat)
+    return {
+        'send_and_wait': _metric(1 / per_call, 'round trips/s', 'higher'),
+        'lean_send_and_wait': _metric(
+            1 / lean_call, 'round trips/s', 'higher'
+        ),
+    }
+
+
+def bench_servo_construction(iterations, repeat):
+    """Building a Servo object from the XL-320 descriptor"""
+    bus = protocol2.Protocol2Bus(fakebus.make_uart([1]))
+    descriptor = servodata.get_servo(fakebus.DEFAULT_MODEL)
+    per_call = _best_time(
+        lambda: servo.Servo(bus, 1, descriptor), iterations, repeat
+    )
+    return {'servo_construction': _metric(per_call * 1e6, 'us', 'lower')}
+
+
+def bench_codec(iterations, repeat):
+    """Encoding and decoding a scaled register value"""
+    display = servodata.find_register(
+        servodata.get_servo(fakebus.DEFAULT_MODEL), 'Goal Position'
+    )['display']
+    encode = _best_time(
+        lambda: servo.format_data_inverse(45.0, display), iterations, repeat
+    )
+    decode = _best_time(
+        lambda: servo.format_data([0x99, 0x02], display), iterations, repeat
+    )
+    return {
+        'register_encode': _metric(encode * 1e6, 'us', 'lower'),
+        'register_decode': _metric(decode * 1e6, 'us', 'lower'),
+    }
+
+
+def bench_cycle(iterations, repeat, servo_count=DEFAULT_SERVO_COUNT):
+    """A control cycle: set Goal Position then read Present Position on
+    every servo. Reports CPU time and CPU plus modelled wire time for each
+    baud rate"""
+    results = {}
+    for baud in XL320_BAUDS:
+        uart = fakebus.make_uart(range(1, servo_count + 1), baud)
+        bus = protocol2.Protocol2Bus(uart)
+        descriptor = servodata.get_servo(fakebus.DEFAULT_MODEL)
+        servos = [
+            servo.Servo(bus, address, descriptor)
+            for address in range(1, servo_count + 1)
+        ]
+
+        def cycle():
+            for serv in servos:
+                serv.set_goal_position(10.0)
+                serv.get_present_position()
+
+        uart.wire_time = 0.0
+        cpu = _best_time(cycle, iterations, repeat)
+        wire = uart.wire_time / (iterations * repeat)
+        prefix = 'cycle_{}servos_{}'.format(servo_count, baud)
+        results[prefix + '_cpu'] = _metric(cpu * 1e3, 'ms', 'lower')
+        results[prefix + '_total'] = _metric((cpu + wire) * 1e3, 'ms', 'lower')
+    return results
+
+
+BENCHMARKS = [
+    (bench_crc, 20000),
+    (bench_build_packet, 20000),
+    (bench_round_trip, 2000),
+    (bench_servo_construction, 500),
+    (bench_codec, 20000),
+    (bench_cycle, 50),
+]
+
+
+def run_benchmarks(scale=1.0, repeat=5):
+    """Runs every benchmark and returns a JSON-serializable dict of the
+    results. Scale multiplies the number of iterations of each benchmark"""
+    metrics = {}
+    for bench, iterations in BENCHMARKS:
+        metrics.update(bench(max(1, int(iterations * scale)), repeat))
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'time': time.time(),
+        'metrics': metrics,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Compares two results from run_benchmarks. Returns a list of
+    (name, old_value, new_value, relative_change) for every metric that got
+    worse by more than threshold. relative_change is positive for a
+    regression"""
+    regressions = []
+    for name, new in sorted(current['metrics'].items()):
+        old = baseline['metrics'].get(name)
+        if old is None or old['value'] == 0:
+            continue
+        change = (new['value'] - old['value']) / old['value']
+        if new['better'] == 'higher':
+            change = -change
+        if change > threshold:
+            regressions.append((name, old['value'], new['value'], change))
+    return regressions
+
+
+def main(args):
+    """Runs the benchmark using arguments from the console"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the dynamixel library against a fake bus'
+    )
+    parser.add_argument(
+        '--output', default=None,
+        help='File to write the JSON results to (default: stdout)')
+    parser.add_argument(
+        '--compare', default=None,
+        help='A previous result file to check for regressions against')
+    parser.add_argument(
+        '--current', default=None,
+        help='Compare against this result file instead of running again')
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='Relative change counted as a regression (eg 0.1 for 10%%)')
+    parser.add_argument(
+        '--scale', type=float, default=1.0,
+        help='Multiplier on the number of iterations of each benchmark')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of runs of each benchmark (the best is reported)')
+
+    args = parser.parse_args(args)
+
+    if args.current is not None:
+        results = json.load(open(args.current))
+    else:
+        results = run_benchmarks(args.scale, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2, sort_keys=True)
+    elif args.compare is None:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare is not None:
+        baseline = json.load(open(args.compare))
+        regressions = compare(baseline, results, args.threshold)
+        for name, old, new, change in regressions:
+            print("REGRESSION {}: {:.4g} -> {:.4g} ({:+.1f}%)".format(
+                name, old, new, change * 100
+            ))
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
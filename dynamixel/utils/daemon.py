@@ -0,0 +1,62 @@
+"""Runs a bus daemon so that several processes can share the servos on one
+serial port. See dynamixel.daemon for how clients connect:
+
+    python -m dynamixel.utils.daemon --port /dev/ttyUSB0 --rate 100
+
+and then, from any number of other processes:
+
+    client = dynamixel.daemon.connect('/dev/ttyUSB0')
+    client.servos[1].set_goal_position(45)
+    print(client.servos[1].get_present_position())
+"""
+import argparse
+import sys
+import logging
+import time
+
+import serial
+from .. import daemon, protocol2
+
+logging.getLogger('dynamixel.protocol2').setLevel(logging.CRITICAL)
+
+
+def main(args):
+    """Runs the daemon using arguments from the console"""
+    parser = argparse.ArgumentParser(
+        description='Share a dynamixel bus between processes'
+    )
+    parser.add_argument(
+        '--port', default='/dev/ttyUSB0',
+        help='The TTY the servos are on (eg /dev/ttyUSB0)')
+    parser.add_argument(
+        '--baud', type=int, default=1000000,
+        help='Baud rate (eg 115200)')
+    parser.add_argument(
+        '--timeout', type=float, default=0.005,
+        help='How long to wait for a servo to reply')
+    parser.add_argument(
+        '--rate', type=float, default=100,
+        help='Bus cycles per second')
+    parser.add_argument(
+        '--socket', default=None,
+        help='Unix socket to listen on (default based on the port name)')
+
+    args = parser.parse_args(args)
+    uart = serial.Serial(args.port, args.baud, timeout=args.timeout)
+    bus = protocol2.Protocol2Bus(uart)
+    socket_path = args.socket or daemon.default_socket_path(args.port)
+    bus_daemon = daemon.BusDaemon(bus, socket_path, cycle_time=1 / args.rate)
+    bus_daemon.start()
+    print("Sharing {} servos on {}".format(len(bus_daemon.slots), socket_path))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus_daemon.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,381 @@
+"""An in-process stand-in for a half-duplex dynamixel bus. The FakeUart can
+be handed to a Protocol2Bus in place of a serial.Serial and answers packets
+the same way a chain of real servos would, including echoing the transmitted
+bytes back (as a UART with TX and RX tied together does).
+
+It also keeps track of how long the traffic would have taken on a real wire
+so that benchmarks and tests can reason about bus time without hardware."""
+from .. import protocol2, servo as servo_module, servodata
+from ..protocol2 import (
+    BROADCAST_ADDRESS, PING, READ, WRITE, REG_WRITE, ACTION, FACTORY_RESET,
+    REBOOT, STATUS, SYNC_READ, SYNC_WRITE, BULK_READ, BULK_WRITE
+)
+
+DEFAULT_MODEL = 350
+DEFAULT_RETURN_DELAY_US = 500
+
+
+class FakeServo:
+    """A simulated servo with a control table. The initial contents of the
+    control table are taken from the servo descriptor where possible, with
+    the model number, firmware version and ID filled in.
+
+    Setting connected to False makes the servo ignore all traffic (as if it
+    had been unplugged). Setting hardware_error to a non-zero value makes
+    the servo set the alert bit in every status packet it sends."""
+    def __init__(self, address, model_number=DEFAULT_MODEL, firmware=0x1F,
+                 table_size=None):
+        self.model_number = model_number
+        self.firmware = firmware
+        self.connected = True
+        self.hardware_error = 0
+        self.return_delay_us = DEFAULT_RETURN_DELAY_US
+        self.registered = None
+
+        self.descriptor = descriptor = servodata.get_servo(model_number)
+        if table_size is None:
+            table_size = 64
+            if descriptor is not None:
+                table_size = servodata.table_size(descriptor)
+        self.control_table = bytearray(table_size)
+        self.control_table[0] = model_number % 256
+        self.control_table[1] = model_number >> 8
+        self.control_table[self._register_address('Firmware Version', 2)] = (
+            firmware
+        )
+        self._id_address = self._register_address('ID', 3)
+        self.control_table[self._id_address] = address
+        self._return_level = None
+        if descriptor is not None:
+            self._return_level = servodata.find_register(
+                descriptor, 'Return Level'
+            )
+        if self._return_level is not None:
+            self.control_table[self._return_level['address']] = 2
+
+        # Indirect Data registers stand in for the bytes of the control
+        # table given by the matching Indirect Address registers
+        self.indirect = {}
+        if descriptor is not None:
+            slot = 1
+            while True:
+                data_register = servodata.find_register(
+                    descriptor, 'Indirect Data {}'.format(slot)
+                )
+                address_register = servodata.find_register(
+                    descriptor, 'Indirect Address {}'.format(slot)
+                )
+                if data_register is None or address_register is None:
+                    break
+                pointer = address_register['address']
+                self.indirect[data_register['address']] = pointer
+                # Like a real servo, each slot starts out pointing at itself
+                self.control_table[pointer] = data_register['address'] % 256
+                self.control_table[pointer + 1] = data_register['address'] >> 8
+                slot += 1
+
+    @property
+    def address(self):
+        """The servo's ID, from its ID register"""
+        return self.control_table[self._id_address]
+
+    def _register_address(self, name, default):
+        if self.descriptor is None:
+            return default
+        register = servodata.find_register(self.descriptor, name)
+        return default if register is None else register['address']
+
+    def _resolve(self, register):
+        """Returns where a byte of the control table really lives,
+        following indirect addresses"""
+        pointer = self.indirect.get(register)
+        if pointer is None:
+            return register
+        return self.control_table[pointer] + (
+            self.control_table[pointer + 1] << 8
+        )
+
+    def read_table(self, register, length):
+        """Returns a copy of part of the control table"""
+        if not self.indirect:
+            return bytes(self.control_table[register:register + length])
+        return bytes(
+            self.control_table[self._resolve(pos)]
+            for pos in range(register, register + length)
+        )
+
+    def write_table(self, register, data):
+        """Writes into the control table"""
+        if not self.indirect:
+            self.control_table[register:register + len(data)] = bytes(data)
+            return
+        for pos, byte in enumerate(data):
+            self.control_table[self._resolve(register + pos)] = byte
+
+    def _baud_register(self):
+        if self.descriptor is None:
+            return None
+        return servodata.find_register(self.descriptor, 'Baud Rate')
+
+    @property
+    def baudrate(self):
+        """The baud rate the servo is listening at, from its Baud Rate
+        register. None if the model has no such register (such servos hear
+        every baud rate)"""
+        register = self._baud_register()
+        if register is None:
+            return None
+        return servodata.baud_rate_from_value(
+            self.descriptor, self.control_table[register['address']]
+        )
+
+    @baudrate.setter
+    def baudrate(self, baud_rate):
+        register = self._baud_register()
+        value = None
+        if register is not None:
+            value = servodata.baud_rate_value(self.descriptor, baud_rate)
+        if value is not None:
+            self.control_table[register['address']] = value
+
+    @property
+    def return_level(self):
+        """The servo's Status Return Level (2, replying to everything, if the
+        model has no such register)"""
+        if self._return_level is None:
+            return 2
+        return self.control_table[self._return_level['address']]
+
+    def replies_to(self, instruction):
+        """Returns True if the return level means the servo sends a status
+        packet for an instruction"""
+        if instruction == PING:
+            return True
+        if instruction == READ:
+            return self.return_level >= 1
+        return self.return_level >= 2
+
+    def status(self, parameters=b''):
+        """Builds the status packet this servo would return"""
+        error = 0x80 if self.hardware_error else 0x00
+        return protocol2.Protocol2Bus._build_packet(
+            self.address, STATUS, [error] + list(parameters)
+        )
+
+    def handle(self, instruction, parameters):
+        """Executes an instruction addressed to this servo directly and
+        returns the status parameters, or None if the instruction does not
+        produce a reply"""
+        if instruction == PING:
+            return [
+                self.model_number % 256, self.model_number >> 8, self.firmware
+            ]
+        if instruction == READ:
+            register = parameters[0] + (parameters[1] << 8)
+            length = parameters[2] + (parameters[3] << 8)
+            return list(self.read_table(register, length))
+        if instruction == WRITE:
+            register = parameters[0] + (parameters[1] << 8)
+            self.write_table(register, parameters[2:])
+            return []
+        if instruction == REG_WRITE:
+            register = parameters[0] + (parameters[1] << 8)
+            self.registered = (register, bytes(parameters[2:]))
+            return []
+        if instruction == ACTION:
+            if self.registered is not None:
+                self.write_table(*self.registered)
+                self.registered = None
+            return []
+        if instruction in (FACTORY_RESET, REBOOT):
+            return []
+        return None
+
+
+class FakeUart:
+    """Looks enough like a serial.Serial for Protocol2Bus to use it. Every
+    packet written is echoed back, followed by any status packets that the
+    simulated servos produce.
+
+    wire_time accumulates the modelled time (in seconds) the traffic would
+    have taken on a real bus at the configured baud rate, including each
+    servo's return delay."""
+    def __init__(self, servos=(), baudrate=1000000):
+        self.servos = {}
+        self.baudrate = baudrate
+        for servo in servos:
+            self.add_servo(servo)
+        self.wire_time = 0.0
+        self.packets_written = 0
+        self.bytes_written = 0
+        self._rx_buffer = bytearray()
+
+    def add_servo(self, servo):
+        """Plugs a FakeServo into the bus. It is set to the bus baud rate"""
+        self.servos[servo.address] = servo
+        servo.baudrate = self.baudrate
+
+    def byte_time(self, count):
+        """Returns how long count bytes take on the wire (8N1 framing)"""
+        return count * 10 / self.baudrate
+
+    @property
+    def in_waiting(self):
+        return len(self._rx_buffer)
+
+    def flush(self):
+        """Nothing is ever buffered on the transmit side"""
+
+    def reset_input_buffer(self):
+        self._rx_buffer.clear()
+
+    def read(self, size=1):
+        data = bytes(self._rx_buffer[:size])
+        del self._rx_buffer[:size]
+        return data
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self._rx_buffer))
+        buffer[:size] = self._rx_buffer[:size]
+        del self._rx_buffer[:size]
+        return size
+
+    def write(self, data):
+        data = bytes(data)
+        self.packets_written += 1
+        self.bytes_written += len(data)
+        self.wire_time += self.byte_time(len(data))
+        self._rx_buffer += data
+        for packet in split_packets(data):
+            for reply, delay_us in self._respond(packet):
+                self.wire_time += delay_us / 1e6 + self.byte_time(len(reply))
+                self._rx_buffer += reply
+        return len(data)
+
+    def _live_servo(self, address):
+        servo = self.servos.get(address)
+        if servo is None or servo.address != address:
+            # Servos stay under the address they were added at, even if
+            # their ID has been changed since
+            servo = next((
+                servo for servo in self.servos.values()
+                if servo.address == address
+            ), None)
+        if servo is None or not servo.connected:
+            return None
+        if servo.baudrate not in (None, self.baudrate):
+            return None
+        return servo
+
+    def _respond(self, packet):
+        """Yields (reply_packet, return_delay_us) for every status packet
+        produced by the servos in response to a packet"""
+        address = packet[4]
+        instruction = packet[7]
+        parameters = list(packet[8:-2])
+
+        if instruction == SYNC_READ:
+            register = parameters[0:2]
+            length = parameters[2:4]
+            for servo_id in parameters[4:]:
+                servo = self._live_servo(servo_id)
+                if servo is not None:
+                    yield self._reply(servo, READ, register + length)
+        elif instruction == BULK_READ:
+            for pos in range(0, len(parameters), 5):
+                servo = self._live_servo(parameters[pos])
+                if servo is not None:
+                    yield self._reply(
+                        servo, READ, parameters[pos + 1:pos + 5]
+                    )
+        elif instruction == SYNC_WRITE:
+            register = parameters[0:2]
+            length = parameters[2] + (parameters[3] << 8)
+            for pos in range(4, len(parameters), length + 1):
+                servo = self._live_servo(parameters[pos])
+                if servo is not None:
+                    servo.handle(
+                        WRITE,
+                        register + parameters[pos + 1:pos + 1 + length]
+                    )
+        elif instruction == BULK_WRITE:
+            pos = 0
+            while pos < len(parameters):
+                length = parameters[pos + 3] + (parameters[pos + 4] << 8)
+                servo = self._live_servo(parameters[pos])
+                if servo is not None:
+                    servo.handle(
+                        WRITE,
+                        parameters[pos + 1:pos + 3]
+                        + parameters[pos + 5:pos + 5 + length]
+                    )
+                pos += 5 + length
+        elif address == BROADCAST_ADDRESS:
+            for servo_id in sorted(
+                    servo.address for servo in self.servos.values()
+            ):
+                servo = self._live_servo(servo_id)
+                if servo is None:
+                    continue
+                result = servo.handle(instruction, parameters)
+                if instruction == PING:
+                    yield servo.status(result), servo.return_delay_us
+        else:
+            servo = self._live_servo(address)
+            if servo is not None:
+                reply = self._reply(servo, instruction, parameters)
+                if reply[0] is not None:
+                    yield reply
+
+    @staticmethod
+    def _reply(servo, instruction, parameters):
+        result = servo.handle(instruction, parameters)
+        if result is None or not servo.replies_to(instruction):
+            return None, 0
+        return servo.status(result), servo.return_delay_us
+
+
+def split_packets(data):
+    """Splits a stream of bytes into individual protocol2 packets. Anything
+    that cannot be parsed is discarded"""
+    packets = []
+    pos = 0
+    while pos + 7 <= len(data):
+        if data[pos:pos + 4] != b'\xff\xff\xfd\x00':
+            pos += 1
+            continue
+        length = data[pos + 5] + (data[pos + 6] << 8)
+        end = pos + 7 + length
+        if end > len(data):
+            break
+        packets.append(data[pos:end])
+        pos = end
+    return packets
+
+
+def make_uart(addresses, baudrate=1000000, model_number=DEFAULT_MODEL):
+    """Returns a FakeUart with a FakeServo at each of the addresses"""
+    return FakeUart(
+        [FakeServo(address, model_number) for address in addresses],
+        baudrate
+    )
+
+
+def make_bus(addresses, baudrate=1000000, model_number=DEFAULT_MODEL,
+             **bus_args):
+    """Returns (bus, uart): a Protocol2Bus on a FakeUart made by make_uart.
+    bus_args are passed on to the Protocol2Bus"""
+    uart = make_uart(addresses, baudrate, model_number)
+    return protocol2.Protocol2Bus(uart, **bus_args), uart
+
+
+def make_servos(addresses, baudrate=1000000, model_number=DEFAULT_MODEL,
+                **bus_args):
+    """Like make_bus, but also makes a servo.Servo for each of the
+    addresses. Returns (bus, uart, servos)"""
+    bus, uart = make_bus(addresses, baudrate, model_number, **bus_args)
+    descriptor = servodata.get_servo(model_number)
+    servos = [
+        servo_module.Servo(bus, address, descriptor) for address in addresses
+    ]
+    return bus, uart, servos
@@ -0,0 +1,119 @@
+"""A CLI for backing up and provisioning the servos on one or more buses.
+
+    dump     Saves the control table of every servo to a json file
+    diff     Shows how the servos differ from a profile
+    restore  Writes only the differences from a profile to the servos
+
+Several --port flags can be given, in which case each port is handled in
+parallel. A profile can be a dump (or a hand written file, see
+dynamixel.provision). When several ports are used, the dump has an entry per
+port under "buses", and a profile with a "buses" entry is applied per port"""
+import argparse
+import sys
+import logging
+
+import serial
+from .. import protocol2, provision
+
+logging.getLogger('dynamixel.protocol2').setLevel(logging.CRITICAL)
+
+
+def _open_bus(port, baud, timeout):
+    uart = serial.Serial(port, baud, timeout=timeout)
+    return protocol2.Protocol2Bus(uart)
+
+
+def _bus_profile(profile, port):
+    """Picks the part of a profile that applies to a port"""
+    if 'buses' in profile:
+        return profile['buses'].get(port, {})
+    return profile
+
+
+def do_dump(buses, output):
+    """Dumps every bus to a file"""
+    dumps = provision.run_on_buses(provision.dump_control_tables, buses.values())
+    data = {
+        port: provision.dump_to_json(dump)
+        for port, dump in zip(buses, dumps)
+    }
+    for port, dump in zip(buses, dumps):
+        print("{}: dumped {} servos".format(port, len(dump)))
+    if len(data) == 1:
+        data = list(data.values())[0]
+    else:
+        data = {'buses': data}
+    provision.save(data, output)
+
+
+def do_diff(buses, profile):
+    """Prints the differences between each bus and the profile. The buses
+    are compared in parallel"""
+    def diff(port):
+        return provision.diff_bus(buses[port], _bus_profile(profile, port))
+
+    results = provision.run_on_buses(diff, buses)
+    for port, differences in zip(buses, results):
+        if not differences:
+            print("{}: matches profile".format(port))
+        for address, servo_diff in differences.items():
+            for name, current, target in servo_diff:
+                print("{} servo {}: {} {} -> {}".format(
+                    port, address, name, current.hex(), target.hex()
+                ))
+
+
+def do_restore(buses, profile):
+    """Restores each bus to match the profile, in parallel"""
+    def restore(port):
+        return provision.restore_bus(buses[port], _bus_profile(profile, port))
+
+    results = provision.run_on_buses(restore, buses)
+    failed = False
+    for port, result in zip(buses, results):
+        for address, writes in result.items():
+            if writes is None:
+                failed = True
+                print("{} servo {}: FAILED".format(port, address))
+            else:
+                print("{} servo {}: {} writes".format(port, address, writes))
+    return 1 if failed else 0
+
+
+def main(args):
+    """Runs the provisioning tool using arguments from the console"""
+    parser = argparse.ArgumentParser(
+        description='Back up and provision dynamixel servos'
+    )
+    parser.add_argument(
+        'command', choices=['dump', 'diff', 'restore'],
+        help='What to do')
+    parser.add_argument(
+        'file',
+        help='File to dump to, or the profile to diff/restore from')
+    parser.add_argument(
+        '--port', action='append',
+        help='A TTY the servos are on (eg /dev/ttyUSB0). Can be repeated')
+    parser.add_argument(
+        '--baud', type=int, default=1000000,
+        help='Baud rate (eg 115200)')
+    parser.add_argument(
+        '--timeout', type=float, default=(5/254),
+        help='How long to wait before deciding a servo is not present')
+
+    args = parser.parse_args(args)
+    ports = args.port or ['/dev/ttyUSB0']
+    buses = {port: _open_bus(port, args.baud, args.timeout) for port in ports}
+
+    if args.command == 'dump':
+        do_dump(buses, args.file)
+        return 0
+    profile = provision.load(args.file)
+    if args.command == 'diff':
+        do_diff(buses, profile)
+        return 0
+    return do_restore(buses, profile)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -6,28 +6,47 @@ import sys
 import logging
 
 import serial
-from .. import protocol2, servodata
+from .. import protocol2, servodata, topology
 
 logging.getLogger('dynamixel.protocol2').setLevel(logging.CRITICAL)
 
 
-def do_scan(port, baud, timeout):
-    """Actually performs the scan"""
+def describe(address, info):
+    """Prints a line about a servo that was found"""
+    servo_data = servodata.get_servo(info['model_number'])
+    if servo_data is None:
+        servo_name = "Unknown Servo Model"
+    else:
+        servo_name = servo_data['name']
+    print("Found an {} at address {}".format(servo_name, address))
+
+
+def do_scan(port, baud, timeout, use_cache=True):
+    """Actually performs the scan. If the servos found last time on this
+    port and baud rate are all still there, they are listed without
+    scanning (unless use_cache is False)"""
     uart = serial.Serial(port, baud, timeout=timeout)
     bus = protocol2.Protocol2Bus(uart)
+    cache = topology.TopologyCache()
 
+    known = cache.get(port, baud) if use_cache else None
+    if known and topology.check(bus, known):
+        print("Servos on {} at baud {} match the last scan".format(port, baud))
+        for address, info in sorted(known.items()):
+            describe(address, info)
+        print("Done")
+        return
 
     print("Scanning {} at baud {}".format(port, baud))
+    servos = {}
     for address in range(254):
-        servo_model = bus.ping(address)
+        found = topology.scan(bus, [address])
         print("{}/{}".format(address, 254), end="\r")
-        if servo_model is not None:
-            servo_data = servodata.get_servo(servo_model)
-            if servo_data is None:
-                servo_name = "Unknown Servo Model"
-            else:
-                servo_name = servo_data['name']
-            print("Found an {} at address {}".format(servo_name, address))
+        if found:
+            describe(address, found[address])
+            servos.update(found)
+    cache.put(port, baud, servos)
+    cache.save()
 
     print()
     print("Done")
@@ -47,9 +66,12 @@ def main(args):
     parser.add_argument(
         '--timeout', type=float, default=(5/254),
         help='How long to wait before deciding a servo is not present')
+    parser.add_argument(
+        '--rescan', action='store_true',
+        help='Scan every address even if the servos match the last scan')
 
     args = parser.parse_args()
-    do_scan(args.port, args.baud, args.timeout)
+    do_scan(args.port, args.baud, args.timeout, not args.rescan)
 
 
 if __name__ == "__main__":
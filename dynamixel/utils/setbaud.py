@@ -0,0 +1,47 @@
+"""A CLI to move every servo on a bus, and the bus itself, to a new baud
+rate. If any servo does not answer at the new rate, everything is put back
+the way it was."""
+import argparse
+import sys
+import logging
+
+import serial
+from .. import baudrate, protocol2
+
+logging.getLogger('dynamixel.protocol2').setLevel(logging.CRITICAL)
+
+
+def main(args):
+    """Changes the baud rate using arguments from the console"""
+    parser = argparse.ArgumentParser(
+        description='Change the baud rate of every dynamixel on a bus'
+    )
+    parser.add_argument(
+        'target', type=int,
+        help='Baud rate to change to (eg 1000000)')
+    parser.add_argument(
+        '--port', default='/dev/ttyUSB0',
+        help='The TTY the servos are on (eg /dev/ttyUSB0)')
+    parser.add_argument(
+        '--baud', type=int, default=57600,
+        help='Baud rate the servos are at now')
+    parser.add_argument(
+        '--timeout', type=float, default=(5/254),
+        help='How long to wait before deciding a servo is not present')
+    parser.add_argument(
+        '--disable-torque', action='store_true',
+        help='Switch the torque off for the change if it is on')
+
+    args = parser.parse_args(args)
+    uart = serial.Serial(args.port, args.baud, timeout=args.timeout)
+    bus = protocol2.Protocol2Bus(uart)
+    if baudrate.change_bus_baud(bus, args.target,
+                                disable_torque=args.disable_torque):
+        print("All servos now at {}".format(args.target))
+        return 0
+    print("Failed, servos left at {}".format(uart.baudrate))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
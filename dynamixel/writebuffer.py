@@ -0,0 +1,125 @@
+"""Combines register writes to several servos into as few packets as
+possible.
+
+Servos attached to a WriteBuffer don't write when one of their set_*
+functions is called. The value is only recorded (replacing any earlier value
+for the same register), and commit() sends everything that is pending:
+
+    buffer = WriteBuffer(bus)
+    buffer.attach(*servos)
+    for serv in servos:
+        serv.set_goal_position(0)
+        serv.set_moving_speed(100)
+    buffer.commit()
+
+Writes to neighbouring registers of a servo are joined into one write, and
+the same writes to several servos are sent as one sync write. Whatever is
+left is sent as bulk writes (or a normal write if only one servo is left).
+commit() can be run by a BusScheduler every cycle (see
+BusScheduler.add_write_buffer)."""
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    """Holds the latest value written to each register of each servo until
+    commit() is called. It is safe to write to the buffer from several
+    threads"""
+    def __init__(self, bus):
+        self.bus = bus
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def attach(self, *servos):
+        """Makes the set_* functions of servos write to this buffer"""
+        for serv in servos:
+            serv.write_buffer = self
+
+    def detach(self, *servos):
+        """Makes the set_* functions of servos write to the bus again"""
+        for serv in servos:
+            if serv.write_buffer is self:
+                serv.write_buffer = None
+
+    def set(self, address, register, data):
+        """Records that data should be written to a servo starting at
+        register. Later writes to the same bytes replace earlier ones"""
+        with self._lock:
+            pending = self._pending.setdefault(address, {})
+            for pos, byte in enumerate(data):
+                pending[register + pos] = byte
+
+    def __len__(self):
+        """The number of servos with writes pending"""
+        return len(self._pending)
+
+    def discard(self):
+        """Forgets every pending write"""
+        with self._lock:
+            self._pending = {}
+
+    def take(self):
+        """Removes the pending writes from the buffer and returns them as a
+        dict mapping servo address to a list of (register, data) with the
+        neighbouring bytes joined up"""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        return {
+            address: contiguous_runs(written)
+            for address, written in pending.items()
+        }
+
+    def commit(self):
+        """Sends every pending write. Returns the number of packets sent"""
+        runs = self.take()
+        if not runs:
+            return 0
+        packets = 0
+
+        by_block = {}
+        for address, servo_runs in runs.items():
+            for register, data in servo_runs:
+                by_block.setdefault((register, len(data)), {})[address] = data
+        leftovers = {}
+        for (register, length), values in by_block.items():
+            if len(values) > 1:
+                self.bus.sync_write(register, length, values)
+                packets += 1
+            else:
+                for address, data in values.items():
+                    leftovers.setdefault(address, []).append((register, data))
+
+        # A bulk write carries at most one write per servo
+        while leftovers:
+            writes = []
+            for address in list(leftovers):
+                register, data = leftovers[address].pop(0)
+                writes.append((address, register, data))
+                if not leftovers[address]:
+                    del leftovers[address]
+            if len(writes) == 1:
+                address, register, data = writes[0]
+                if self.bus.write(address, register, data) is None:
+                    LOGGER.error(
+                        "Failed to write register %d of servo %d",
+                        register, address
+                    )
+            else:
+                self.bus.bulk_write(writes)
+            packets += 1
+        return packets
+
+
+def contiguous_runs(written):
+    """Converts a dict mapping register address to byte into a sorted list
+    of (register, data) with one entry per run of neighbouring bytes"""
+    runs = []
+    for register in sorted(written):
+        if runs and runs[-1][0] + len(runs[-1][1]) == register:
+            runs[-1][1].append(written[register])
+        else:
+            runs.append((register, [written[register]]))
+    return runs
@@ -5,7 +5,7 @@ import logging
 import serial
 import time
 import fix_path
-from dynamixel import protocol2, servodata, servo
+from dynamixel import motion, protocol2, servodata, servo
 
 #logging.getLogger('protocol2').setLevel(logging.DEBUG)
 logging.getLogger('servo').setLevel(logging.CRITICAL)
@@ -32,13 +32,13 @@ servo_2.set_led(4)
 time.sleep(1)
 
 servo_2.set_goal_position(0)
-time.sleep(1)
+motion.wait_until_reached([servo_2])
 print(servo_2.get_present_position(), '=0?')
 servo_2.set_goal_position(45)
-time.sleep(1)
+motion.wait_until_reached([servo_2])
 print(servo_2.get_present_position(), '=45?')
 servo_2.set_goal_position(-45)
-time.sleep(1)
+motion.wait_until_reached([servo_2])
 print(servo_2.get_present_position(), '=-45?')
 
 #for i in range(1000):
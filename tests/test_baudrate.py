@@ -0,0 +1,52 @@
+import fix_path
+import pytest
+from dynamixel import baudrate, servodata
+from dynamixel.utils import fakebus
+
+
+def test_change_bus_baud():
+    bus, uart = fakebus.make_bus([1, 2, 3], 57600)
+    packets = uart.packets_written
+    assert baudrate.change_bus_baud(bus, 1000000, settle_time=0)
+    assert uart.baudrate == 1000000
+    assert all(servo.baudrate == 1000000 for servo in uart.servos.values())
+    # Broadcast ping, a torque read per servo, one broadcast baud write and
+    # a ping per servo to check
+    assert uart.packets_written - packets == 1 + 3 + 1 + 3
+    assert bus.broadcast_ping() == {1: 350, 2: 350, 3: 350}
+
+
+def test_rollback_when_servo_lost():
+    bus, uart = fakebus.make_bus([1, 2], 57600)
+
+    # Servo 2 "misses" the change and stays at the old rate
+    original_write = uart.servos[2].write_table
+    uart.servos[2].write_table = lambda register, data: None
+    assert not baudrate.change_bus_baud(bus, 115200, settle_time=0)
+    uart.servos[2].write_table = original_write
+    assert uart.baudrate == 57600
+    assert uart.servos[1].baudrate == 57600
+    assert bus.broadcast_ping() == {1: 350, 2: 350}
+
+
+def test_torque_and_unsupported_rates():
+    bus, uart = fakebus.make_bus([1], 57600)
+    with pytest.raises(ValueError):
+        baudrate.change_bus_baud(bus, 2000000, settle_time=0)
+
+    uart.servos[1].write_table(24, [1])
+    assert not baudrate.change_bus_baud(bus, 1000000, settle_time=0)
+    assert uart.baudrate == 57600
+    assert baudrate.change_bus_baud(
+        bus, 1000000, disable_torque=True, settle_time=0
+    )
+    assert uart.servos[1].read_table(24, 1) == b'\x01'
+    assert uart.servos[1].baudrate == 1000000
+
+
+def test_replies_drained_between_servos():
+    bus, uart = fakebus.make_bus([1, 2], 57600)
+    servos = {address: servodata.get_servo(350) for address in (1, 2)}
+    baudrate._write_baud(bus, servos, 1000000, broadcast=False)
+    # Nothing the servos sent back is left to be taken as a later reply
+    assert uart.in_waiting == 0
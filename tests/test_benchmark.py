@@ -0,0 +1,32 @@
+import fix_path
+from dynamixel import protocol2
+from dynamixel.utils import benchmark, fakebus
+
+
+def test_fake_uart_round_trip():
+    uart = fakebus.make_uart([1, 2])
+    bus = protocol2.Protocol2Bus(uart)
+    assert bus.ping(1) == 350
+    assert bus.ping(3) is None
+    assert bus.write(2, 30, [0x00, 0x02]) == b'\x00'
+    assert bus.read(2, 30, 2) == b'\x00\x00\x02'
+    assert uart.wire_time > 0
+
+
+def test_compare_flags_regressions():
+    old = {'metrics': {
+        'fast': {'value': 100.0, 'unit': 'calls/s', 'better': 'higher'},
+        'slow': {'value': 10.0, 'unit': 'ms', 'better': 'lower'},
+    }}
+    new = {'metrics': {
+        'fast': {'value': 80.0, 'unit': 'calls/s', 'better': 'higher'},
+        'slow': {'value': 10.5, 'unit': 'ms', 'better': 'lower'},
+    }}
+    regressions = benchmark.compare(old, new, 0.1)
+    assert [reg[0] for reg in regressions] == ['fast']
+    assert benchmark.compare(old, old) == []
+
+
+def test_run_benchmarks():
+    results = benchmark.run_benchmarks(scale=0.001, repeat=1)
+    assert results['metrics']['cycle_8servos_1000000_total']['value'] > 0
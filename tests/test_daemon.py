@@ -0,0 +1,82 @@
+import os
+import tempfile
+import threading
+import time
+
+import fix_path
+from dynamixel import daemon
+from dynamixel.utils import fakebus
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def test_state_block_seqlock():
+    name = 'dxl-test-{}'.format(os.getpid())
+    block = daemon.StateBlock.create(name, 2, 53)
+    try:
+        block.publish(1, 7, 350, 37, b'\x01\x02', 1234)
+        reader = daemon.StateBlock.attach(name)
+        address, model, stamp, table = reader.snapshot(1)
+        assert (address, model, stamp) == (7, 350, 1234)
+        assert table[37:39] == b'\x01\x02' and len(table) == 53
+        assert reader.snapshot(0)[0] == 0
+        reader.close()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_daemon_and_client():
+    bus, uart = fakebus.make_bus([1, 2])
+    uart.servos[2].write_table(37, [0, 2])
+    socket_path = os.path.join(tempfile.mkdtemp(), 'bus.sock')
+    bus_daemon = daemon.BusDaemon(bus, socket_path, cycle_time=0.002)
+    bus_daemon.start()
+    try:
+        client = daemon.DaemonClient(socket_path)
+        assert sorted(client.servos) == [1, 2]
+        servo_2 = client.servos[2]
+        assert servo_2.get_present_position() == 0.0
+        assert servo_2.get_model_number() == '15e'
+
+        assert servo_2.set_goal_position(29.0)
+        assert wait_for(lambda: uart.servos[2].read_table(30, 2) == b'\x64\x02')
+        uart.servos[2].write_table(37, [0x64, 0x02])
+        assert wait_for(lambda: abs(servo_2.get_present_position() - 29) < 0.01)
+
+        assert servo_2.set_led(3, wait=True)
+        assert uart.servos[2].read_table(25, 1) == b'\x03'
+        assert servo_2.ping()
+        client.close()
+    finally:
+        bus_daemon.stop()
+    assert not os.path.exists(socket_path)
+
+
+def test_requests_fail_rather_than_hang():
+    bus, _uart = fakebus.make_bus([1])
+    socket_path = os.path.join(tempfile.mkdtemp(), 'bus.sock')
+    # Never started, so nothing runs the requests
+    bus_daemon = daemon.BusDaemon(bus, socket_path, request_timeout=0.01)
+    reply = bus_daemon.handle_request({'cmd': 'ping', 'address': 1})
+    assert not reply['ok']
+
+    bus_daemon.request_timeout = 10
+    replies = []
+    thread = threading.Thread(target=lambda: replies.append(
+        bus_daemon.handle_request({'cmd': 'read', 'address': 1,
+                                   'register': 37, 'length': 2})
+    ))
+    thread.start()
+    assert wait_for(lambda: bus_daemon._commands.qsize() == 2)
+    bus_daemon.stop()
+    thread.join(1.0)
+    assert replies and not replies[0]['ok']
+    assert not bus_daemon.handle_request({'cmd': 'ping', 'address': 1})['ok']
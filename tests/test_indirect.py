@@ -0,0 +1,61 @@
+import fix_path
+import pytest
+from dynamixel import indirect, servodata
+from dynamixel.utils import fakebus
+
+XM430 = 1020
+REGISTERS = ['Goal Position', 'Present Current', 'Present Position']
+
+
+def make_block(addresses):
+    bus, uart = fakebus.make_bus(addresses, model_number=XM430)
+    block = indirect.IndirectBlock(servodata.get_servo(XM430), REGISTERS)
+    return bus, uart, block
+
+
+def test_layout():
+    descriptor = servodata.get_servo(XM430)
+    assert indirect.indirect_slots(descriptor) == 28
+    assert indirect.indirect_slots(servodata.get_servo(350)) == 0
+    _, _, block = make_block([])
+    assert block.size == 10
+    assert block.offsets == {
+        'Goal Position': 0, 'Present Current': 4, 'Present Position': 6
+    }
+    assert block.address_map()[:4] == [116, 0, 117, 0]
+    with pytest.raises(ValueError):
+        indirect.IndirectBlock(descriptor, REGISTERS, first_slot=20)
+    with pytest.raises(ValueError):
+        indirect.IndirectBlock(servodata.get_servo(350), ['LED'])
+
+
+def test_read_and_write():
+    bus, uart, block = make_block([1, 2])
+    fake = uart.servos[1]
+    assert not block.is_programmed(bus, 1)
+    assert block.program(bus, 1)
+    assert block.is_programmed(bus, 1)
+
+    fake.write_table(126, [0xF6, 0xFF])
+    fake.write_table(132, (3072).to_bytes(4, 'little'))
+    packets = uart.packets_written
+    values = block.read(bus, 1)
+    assert uart.packets_written == packets + 1
+    assert values['Present Current'] == -10
+    assert abs(values['Present Position'] - 1024 * 0.088) < 0.01
+
+    assert block.write(bus, 1, {'Goal Position': 0})
+    assert fake.read_table(116, 4) == (2048).to_bytes(4, 'little')
+    with pytest.raises(ValueError):
+        block.write(bus, 1, {'Goal Position': 0, 'Present Position': 0})
+
+    assert block.program_group(bus, [1, 2]) == [1, 2]
+    uart.servos[2].write_table(126, [5, 0])
+    group = block.read_group(bus, [1, 2])
+    assert group[1]['Present Current'] == -10
+    assert group[2]['Present Current'] == 5
+
+    block.write_group(bus, {1: {'Goal Position': 10}, 2: {'Goal Position': 20}})
+    assert uart.servos[2].read_table(116, 4) == (
+        2048 + int(20 / 0.088)
+    ).to_bytes(4, 'little')
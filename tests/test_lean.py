@@ -0,0 +1,98 @@
+import tracemalloc
+
+import fix_path
+from dynamixel import lean, protocol2, servo, servodata
+from dynamixel.utils import fakebus
+
+
+def test_crc():
+    assert list(lean.CRC_TABLE) == protocol2.CRC_TABLE
+    assert lean.crc16([0]) == 0
+    assert lean.crc16([1, 2, 3, 4]) == 40499
+    assert lean.crc16([230, 15, 67]) == 11890
+
+
+def test_pack_packet():
+    build = lean.Protocol2Bus._build_packet
+    assert build(0x01, 0x03, [0x01, 0x00]) == b'\xff\xff\xfd\x00\x01\x05\x00\x03\x01\x00h\xa3'
+    assert build(0x04, 0x01, []) == b'\xff\xff\xfd\x00\x04\x03\x00\x01\x19\n'
+
+
+def test_transactions():
+    uart = fakebus.make_uart([1])
+    bus = lean.Protocol2Bus(uart)
+    assert bus.ping(1) == 350
+    assert bus.ping(2) is None
+    assert bus.last_error == lean.ERR_TIMEOUT
+    assert bus.write(1, 30, [0x00, 0x02]) == b'\x00'
+    assert bus.read(1, 30, 2) == b'\x00\x00\x02'
+    assert bus.send_and_wait(1, lean.READ, [30, 0, 2, 0]) == b'\x00\x00\x02'
+    bus.send_blind(1, lean.WRITE, [25, 0, 3])
+    assert uart.servos[1].read_table(25, 1) == b'\x03'
+
+
+def test_servo():
+    uart = fakebus.make_uart([1])
+    bus = lean.Protocol2Bus(uart)
+    servo_1 = lean.Servo(bus, 1, servodata.get_servo(350))
+    assert servo_1.set_goal_position(29.0)
+    assert uart.servos[1].read_table(30, 2) == b'\x64\x02'
+    assert abs(servo_1.get_goal_position() - 29) < 0.01
+    assert servo_1.get_model_number() == '15e'
+    assert 'set_led' in dir(servo_1)
+    assert not hasattr(servo_1, 'set_model_number')
+
+
+def test_format_data_start():
+    reply = b'\x00\x04'
+    assert lean.format_data(reply, {'type': 'bytes'}, 1) == b'\x04'
+    assert lean.format_data(reply, {'type': 'bits'}, 1) == b'\x04'
+
+    uart = fakebus.make_uart([1])
+    uart.servos[1].write_table(50, [0x04])
+    descriptor = servodata.get_servo(350)
+    lean_servo = lean.Servo(lean.Protocol2Bus(uart), 1, descriptor)
+    full_servo = servo.Servo(protocol2.Protocol2Bus(uart), 1, descriptor)
+    assert lean_servo.get_hardware_error_status() == b'\x04'
+    assert full_servo.get_hardware_error_status() == b'\x04'
+
+
+class SnapshotUart(fakebus.FakeUart):
+    """Takes a snapshot of what lean.py has allocated every time the bus
+    receives, while the transaction is still going on"""
+    def __init__(self, servos):
+        super().__init__(servos)
+        self.snapshots = []
+
+    def readinto(self, buffer):
+        if tracemalloc.is_tracing():
+            self.snapshots.append(tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(True, lean.__file__)]
+            ))
+        return super().readinto(buffer)
+
+
+def test_no_allocations_in_steady_state():
+    uart = SnapshotUart([fakebus.FakeServo(1)])
+    bus = lean.Protocol2Bus(uart)
+    servo_1 = lean.Servo(bus, 1, servodata.get_servo(350))
+    assert servo_1.get_goal_position is servo_1.get_goal_position
+
+    def transactions():
+        for _ in range(5):
+            bus.write_value(1, 30, 2, 612)
+            bus.read(1, 37, 2)
+            # Stored as 200, a small int CPython doesn't need to allocate
+            servo_1.set_goal_position(-90.48)
+            servo_1.get_goal_position()
+
+    # The first transactions of each size make the views they need
+    transactions()
+    tracemalloc.start()
+    try:
+        transactions()
+    finally:
+        tracemalloc.stop()
+    assert len(uart.snapshots) == 5 * 4 * 3
+    for snapshot in uart.snapshots:
+        assert snapshot.statistics('lineno') == []
@@ -0,0 +1,40 @@
+import fix_path
+from dynamixel import mirror, servodata
+from dynamixel.utils import fakebus
+
+
+def make_mirror(addresses):
+    bus, uart = fakebus.make_bus(addresses)
+    return bus, uart, mirror.ControlTableMirror(
+        servodata.get_servo(350), addresses
+    )
+
+
+def test_refresh_group():
+    bus, uart, table = make_mirror([1, 4])
+    uart.servos[4].write_table(37, [0x64, 0x02, 0x10, 0x00])
+    assert table.span(['Present Position', 'Present Speed']) == (37, 4)
+    assert table.refresh(bus, ['Present Position', 'Present Speed']) == [1, 4]
+
+    assert abs(table['Present Position'][4] - 29) < 0.01
+    assert table['Present Speed'][4] == 16
+    assert table.get(1, 'Present Position') == -512 * 0.29
+    assert table['Present Speed'].all() == {1: 0, 4: 16}
+    assert table['Present Position'].value(4) == 0x264
+    # Nothing outside the span was read
+    assert table['Model Number'].value(4) == 0
+
+    uart.servos[1].connected = False
+    assert table.refresh(bus, ['Present Speed']) == [4]
+
+
+def test_refresh_servo_and_rows():
+    bus, uart, table = make_mirror([1, 2])
+    assert table.refresh_servo(bus, 2)
+    assert bytes(table.row(2)) == uart.servos[2].read_table(0, 53)
+    assert table['ID'][2] == 2
+    assert table['ID'][1] == 0
+    assert len(table.buffer) == 2 * 53
+
+    uart.servos[1].connected = False
+    assert not table.refresh_servo(bus, 1)
@@ -0,0 +1,53 @@
+import fix_path
+from dynamixel import motion
+from dynamixel.utils import fakebus
+
+
+def fake_motion(monkeypatch, uart, step):
+    """Moves every fake servo step raw units towards its goal for every
+    10ms the wait sleeps, setting Moving while it is on its way. Time only
+    passes when sleeping. Returns the list of sleep intervals"""
+    sleeps = []
+    clock = [1000.0]
+
+    def sleep(interval):
+        sleeps.append(interval)
+        clock[0] += interval
+        for fake in uart.servos.values():
+            goal = int.from_bytes(fake.read_table(30, 2), 'little')
+            position = int.from_bytes(fake.read_table(37, 2), 'little')
+            move = int(step * interval / 0.01)
+            position += max(-move, min(move, goal - position))
+            fake.write_table(37, position.to_bytes(2, 'little'))
+            fake.write_table(49, [position != goal])
+    monkeypatch.setattr(motion.time, 'sleep', sleep)
+    monkeypatch.setattr(motion.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(
+        motion.time, 'monotonic_ns', lambda: int(clock[0] * 1e9)
+    )
+    return sleeps
+
+
+def test_wait_until_reached(monkeypatch):
+    _bus, uart, servos = fakebus.make_servos([1, 2])
+    sleeps = fake_motion(monkeypatch, uart, 20)
+    for fake in uart.servos.values():
+        fake.write_table(37, (512).to_bytes(2, 'little'))
+
+    servos[0].set_goal_position(0)
+    servos[1].set_goal_position(58)
+    packets = uart.packets_written
+    assert motion.wait_until_reached(servos)
+    assert uart.servos[2].read_table(37, 2) == (712).to_bytes(2, 'little')
+    # One sync read per poll, and polls speed up close to the target
+    assert uart.packets_written - packets == len(sleeps) + 1
+    assert sleeps[-1] < sleeps[1]
+
+
+def test_targets_and_timeout(monkeypatch):
+    _bus, uart, servos = fakebus.make_servos([1])
+    fake_motion(monkeypatch, uart, 0)
+    assert motion.wait_until_reached(servos, {servos[0]: -148.5})
+    assert not motion.wait_until_reached(
+        servos, {servos[0]: 90}, timeout=0.01
+    )
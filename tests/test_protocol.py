@@ -15,3 +15,66 @@ def test_pack_packet():
     assert build(0x01, 0x03, [0x01, 0x00]) == b'\xff\xff\xfd\x00\x01\x05\x00\x03\x01\x00h\xa3'
     assert build(0x04, 0x01, []) == b'\xff\xff\xfd\x00\x04\x03\x00\x01\x19\n'
 
+
+
+def test_group_instructions():
+    from dynamixel.utils import fakebus
+    bus, uart = fakebus.make_bus([1, 2, 3])
+    assert bus.broadcast_ping() == {1: 350, 2: 350, 3: 350}
+
+    bus.sync_write(30, 2, {1: [1, 2], 3: [3, 4]})
+    assert bus.sync_read([1, 2, 3], 30, 2) == {
+        1: b'\x00\x01\x02', 2: b'\x00\x00\x00', 3: b'\x00\x03\x04'
+    }
+
+    bus.bulk_write([(1, 25, [4]), (2, 30, [5, 6])])
+    assert bus.bulk_read([(1, 25, 1), (2, 30, 2)]) == {
+        1: b'\x00\x04', 2: b'\x00\x05\x06'
+    }
+
+
+def test_retry_and_circuit_breaker():
+    from dynamixel.utils import fakebus
+    policy = protocol2.RetryPolicy(
+        retries=1, failure_threshold=2, probe_interval=60
+    )
+    bus, uart = fakebus.make_bus([1, 2], retry_policy=policy)
+    assert bus.sync_read([1, 2], 37, 2).keys() == {1, 2}
+
+    uart.servos[2].connected = False
+    packets = uart.packets_written
+    assert bus.read(2, 37, 2) is None
+    assert uart.packets_written == packets + 2  # One retry
+    assert bus.read(2, 37, 2) is None
+    assert bus.health[2].is_open
+
+    # While the circuit is open nothing is sent to the servo
+    packets = uart.packets_written
+    assert bus.read(2, 37, 2) is None
+    assert uart.packets_written == packets
+    assert bus.available([1, 2]) == [1]
+    assert bus.sync_read([1, 2], 37, 2).keys() == {1}
+
+    # Group operations don't stop to probe unless asked to
+    uart.servos[2].connected = True
+    policy.probe_interval = 0
+    assert bus.sync_read([1, 2], 37, 2).keys() == {1}
+    assert bus.probe_open_circuits() == [2]
+    assert not bus.health[2].is_open
+    assert bus.sync_read([1, 2], 37, 2).keys() == {1, 2}
+
+
+def test_inline_probing():
+    from dynamixel.utils import fakebus
+    policy = protocol2.RetryPolicy(
+        failure_threshold=1, probe_interval=0, probe_inline=True
+    )
+    bus, uart = fakebus.make_bus([1, 2], retry_policy=policy)
+    assert bus.ping(2) == 350
+    uart.servos[2].connected = False
+    assert bus.read(2, 37, 2) is None
+    assert bus.health[2].is_open
+
+    uart.servos[2].connected = True
+    assert bus.sync_read([1, 2], 37, 2).keys() == {1, 2}
+    assert not bus.health[2].is_open
@@ -0,0 +1,103 @@
+import fix_path
+from dynamixel import protocol2, provision, servodata
+from dynamixel.utils import fakebus
+
+XL320 = servodata.get_servo(350)
+
+
+def test_dump():
+    bus, uart = fakebus.make_bus([1, 5])
+    uart.servos[5].write_table(29, [32])
+    dump = provision.dump_control_tables(bus)
+    assert sorted(dump) == [1, 5]
+    assert dump[5]['control_table'][29] == 32
+    assert dump[5]['control_table'] == uart.servos[5].read_table(0, 53)
+
+
+def test_plan_writes_merges_contiguous_registers():
+    current = bytes(53)
+    target = bytearray(current)
+    target[27] = 1  # D Gain
+    target[29] = 3  # P Gain, I Gain in between is unchanged
+    target[13] = 60  # Lower Limit Voltage (EEPROM)
+    target[15] = 0xFF  # Max Torque
+    writes = provision.plan_writes(current, target, XL320)
+    assert writes == [(13, bytes([60, 0, 0xFF, 0])), (27, bytes([1, 0, 3]))]
+
+
+def test_plan_writes_connection_registers_last():
+    current = bytes(53)
+    target = bytearray(current)
+    target[3] = 7  # ID
+    target[4] = 3  # Baud Rate
+    target[5] = 10
+    writes = provision.plan_writes(current, target, XL320)
+    assert writes == [(5, bytes([10])), (3, bytes([7])), (4, bytes([3]))]
+
+
+def test_restore_is_minimal_and_idempotent():
+    bus, uart = fakebus.make_bus([1, 2])
+    uart.servos[1].write_table(24, [1])  # Torque on
+    profile = {
+        'all': {'P Gain': 32, 'Max Torque': 1000},
+        'servos': {'2': {'registers': {'LED': 4}}},
+    }
+    assert ('LED', b'\x00', b'\x04') in provision.diff_bus(bus, profile)[2]
+    results = provision.restore_bus(bus, profile)
+    # Servo 1 needs torque off, Max Torque, torque back on and P Gain (there
+    # is a gap in the control table between Torque Enable and P Gain)
+    assert results == {1: 4, 2: 3}
+    assert uart.servos[1].read_table(15, 2) == (1000).to_bytes(2, 'little')
+    assert uart.servos[1].read_table(24, 1) == b'\x01'
+    assert uart.servos[2].read_table(25, 5) == bytes([4, 0, 0, 0, 32])
+
+    assert provision.diff_bus(bus, profile) == {}
+    assert provision.restore_bus(bus, profile) == {1: 0, 2: 0}
+
+
+def test_restore_from_dump():
+    bus, uart = fakebus.make_bus([1])
+    saved = provision.dump_to_json(provision.dump_control_tables(bus))
+    uart.servos[1].write_table(27, [9, 9, 9])
+    assert provision.restore_bus(bus, saved) == {1: 1}
+    assert uart.servos[1].read_table(27, 3) == bytes(3)
+
+
+def test_torque_restored_last():
+    bus, uart = fakebus.make_bus([1])
+    fake = uart.servos[1]
+    fake.write_table(24, [1])  # Torque on
+    written = []
+    original_write = fake.write_table
+
+    def record_write(register, data):
+        written.append(register)
+        original_write(register, data)
+    fake.write_table = record_write
+
+    profile = {'servos': {'1': {'registers': {
+        'ID': 7, 'Return Level': 1, 'Max Torque': 1000
+    }}}}
+    # Torque off, Max Torque, ID, Return Level, then torque back on
+    assert provision.restore_bus(bus, profile) == {1: 5}
+    assert written == [24, 15, 3, 17, 24]
+    assert fake.address == 7
+    assert fake.read_table(24, 1) == b'\x01'
+    assert bus.ping(7) == 350 and bus.ping(1) is None
+
+
+def test_restore_fails_if_id_change_lost():
+    bus, uart = fakebus.make_bus([1])
+    uart.servos[1].write_table = lambda register, data: None
+    profile = {'servos': {'1': {'registers': {'ID': 7}}}}
+    assert provision.restore_bus(bus, profile) == {1: None}
+
+
+def test_restore_at_return_level_read():
+    bus, uart = fakebus.make_bus([1, 2])
+    for fake in uart.servos.values():
+        fake.write_table(17, [protocol2.RETURN_READ])
+    # The servos don't reply to writes, so the bus mustn't wait for them
+    assert provision.restore_bus(bus, {'all': {'P Gain': 40}}) == {1: 1, 2: 1}
+    assert bus.return_levels == {1: 1, 2: 1}
+    assert uart.servos[2].read_table(29, 1) == bytes([40])
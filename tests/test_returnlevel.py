@@ -0,0 +1,71 @@
+import fix_path
+from dynamixel import protocol2, returnlevel
+from dynamixel.utils import fakebus
+
+
+def test_replies_to():
+    bus, _uart = fakebus.make_bus([])
+    assert bus.replies_to(1, protocol2.WRITE)
+    bus.return_levels[1] = protocol2.RETURN_READ
+    assert not bus.replies_to(1, protocol2.WRITE)
+    assert bus.replies_to(1, protocol2.READ)
+    bus.return_levels[1] = protocol2.RETURN_PING
+    assert not bus.replies_to(1, protocol2.READ)
+    assert bus.replies_to(1, protocol2.PING)
+
+
+def test_writes_without_replies():
+    bus, uart, servos = fakebus.make_servos([1, 2])
+    assert returnlevel.set_bus_return_level(bus, protocol2.RETURN_READ)
+    assert bus.return_levels == {1: 1, 2: 1}
+    assert uart.servos[2].return_level == 1
+
+    # Goal Position is sent without waiting for (or getting) a reply
+    wire_time = uart.wire_time
+    assert servos[0].set_goal_position(0)
+    assert uart.servos[1].read_table(30, 2) == bytes([0, 2])
+    assert uart.in_waiting == 0
+    write_time = uart.wire_time - wire_time
+
+    # Configuration is read back to check it
+    wire_time = uart.wire_time
+    assert servos[0].set_cw_angle_limit(0)
+    assert uart.wire_time - wire_time > 2 * write_time
+    assert uart.servos[1].read_table(6, 2) == bytes([0, 2])
+
+    # The servo layer keeps the bus's return levels up to date
+    assert servos[1].set_return_level(2)
+    assert bus.return_levels[2] == 2
+    assert servos[1].set_goal_position(0)
+    uart.servos[1].write_table(17, [2])
+    assert servos[0].get_return_level() == 2
+    assert bus.return_levels[1] == 2
+
+
+class LateReplyUart(fakebus.FakeUart):
+    """Status packets only arrive once the bus is waiting for something,
+    as if the servo's return delay were longer than the bus expects"""
+    def __init__(self, servos):
+        super().__init__(servos)
+        self._late = bytearray()
+
+    def write(self, data):
+        echo_end = len(self._rx_buffer) + len(data)
+        result = super().write(data)
+        self._late += self._rx_buffer[echo_end:]
+        del self._rx_buffer[echo_end:]
+        return result
+
+    def read(self, size=1):
+        if not self._rx_buffer:
+            self._rx_buffer += self._late
+            self._late.clear()
+        return super().read(size)
+
+
+def test_return_level_waits_for_late_reply():
+    uart = LateReplyUart([fakebus.FakeServo(1)])
+    bus = protocol2.Protocol2Bus(uart)
+    # The servo replies to this write, but only after the bus has moved on
+    assert bus.write_return_level(1, 17, protocol2.RETURN_ALL) == [0]
+    assert bus.ping(1) == 350
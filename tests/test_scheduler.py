@@ -0,0 +1,90 @@
+import time
+
+import fix_path
+from dynamixel import scheduler
+from dynamixel.utils import fakebus
+
+
+def test_low_priority_fills_slack_round_robin():
+    bus, _uart, _servos = fakebus.make_servos([1])
+    sched = scheduler.BusScheduler(bus, cycle_time=0.1, budget=0.025)
+    ran = []
+    control = sched.add_task(lambda: ran.append('control'), scheduler.CONTROL)
+    for name in 'abc':
+        sched.add_task(
+            lambda name=name: (ran.append(name), time.sleep(0.01)),
+            scheduler.HOUSEKEEPING
+        )
+
+    # Nothing is known about the tasks yet, so everything runs
+    sched.run_cycle()
+    assert ran == ['control', 'a', 'b', 'c']
+
+    # Now only two of the housekeeping tasks fit
+    del ran[:]
+    report = sched.run_cycle()
+    assert ran == ['control', 'a', 'b']
+    assert report['housekeeping']['skipped'] == 1
+    assert report['housekeeping']['fraction'] > 0.5
+
+    # The one that was skipped goes first next time
+    del ran[:]
+    sched.run_cycle()
+    assert ran == ['control', 'c', 'a']
+    assert control.runs == 3
+
+
+def test_slow_task_is_not_skipped_forever():
+    bus, _uart, _servos = fakebus.make_servos([1])
+    sched = scheduler.BusScheduler(bus, cycle_time=0.1, budget=0.01)
+    delays = [0.02]
+    task = sched.add_task(lambda: time.sleep(delays.pop() if delays else 0))
+
+    # One run over the budget, after which the task is fast again
+    sched.run_cycle()
+    assert task.runs == 1
+    sched.run_cycle()
+    assert task.runs == 1 and task.skips == 1
+    for _ in range(10):
+        sched.run_cycle()
+    assert task.runs > 1
+    assert task.estimate < sched.budget
+
+
+def test_group_read_and_hardware_monitor():
+    bus, uart, servos = fakebus.make_servos([1, 2])
+    uart.servos[2].write_table(37, [0, 2])
+    errors = []
+    for serv in servos:
+        serv.on_hardware_error.append(errors.append)
+
+    sched = scheduler.BusScheduler(bus, cycle_time=0.01, budget=1.0)
+    positions = {}
+    sched.add_group_read(
+        servos, 'Present Position', positions.update, scheduler.CONTROL
+    )
+    sched.add_hardware_monitor(servos)
+    sched.run_cycle()
+    assert positions == {servos[0]: -512 * 0.29, servos[1]: 0.0}
+    assert errors == []
+
+    uart.servos[2].write_table(50, [0x04])  # Overheating
+    sched.run_cycle()
+    assert errors == [servos[1]]
+    assert set(sched.usage()) == {'control', 'housekeeping'}
+
+
+def test_circuit_probe():
+    bus, uart, _servos = fakebus.make_servos([1, 2])
+    bus.retry_policy.failure_threshold = 1
+    bus.retry_policy.probe_interval = 0
+    assert bus.ping(2) == 350
+    uart.servos[2].connected = False
+    assert bus.read(2, 37, 2) is None
+    assert bus.health[2].is_open
+
+    sched = scheduler.BusScheduler(bus, cycle_time=0.01, budget=1.0)
+    sched.add_circuit_probe()
+    uart.servos[2].connected = True
+    sched.run_cycle()
+    assert not bus.health[2].is_open
@@ -0,0 +1,63 @@
+import threading
+
+import fix_path
+from dynamixel import servo, servodata, sharedbus
+from dynamixel.utils import fakebus
+
+
+def make_shared(addresses):
+    bus, uart = fakebus.make_bus(addresses)
+    return sharedbus.SharedBus(bus), uart
+
+
+def test_reads_are_combined():
+    shared, uart = make_shared([1, 2, 3])
+    uart.servos[2].write_table(37, [0x10, 0x02])
+    # Queued before the bus thread starts, so they run as one batch
+    first = shared.read(2, 37, 2)
+    second = shared.read(2, 37, 2)
+    others = [shared.read(address, 37, 2) for address in (1, 3)]
+    write = shared.write(1, 25, [4])
+    after = shared.read(1, 25, 1)
+    shared.start()
+    try:
+        assert list(first.result(1)) == [0, 0x10, 0x02]
+        assert second.result(1) is first.result(1)
+        assert list(others[0].result(1)) == [0, 0, 0]
+        assert write.result(1) is not None
+        assert list(after.result(1)) == [0, 4]
+        # One sync read, one write and one read
+        assert uart.packets_written == 3
+    finally:
+        shared.stop()
+
+
+def test_threads_share_the_bus():
+    shared, uart = make_shared([1, 2])
+    shared.start()
+    view = shared.view()
+    servos = [
+        servo.Servo(view, address, servodata.get_servo(350))
+        for address in (1, 2)
+    ]
+    errors = []
+
+    def worker(serv):
+        for count in range(20):
+            if not serv.set_moving_speed(count):
+                errors.append(count)
+            if serv.get_moving_speed() != count:
+                errors.append(count)
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in servos]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert view.ping(2) == 350
+        assert set(view.broadcast_ping()) == {1, 2}
+        assert view.return_levels is shared.bus.return_levels
+    finally:
+        shared.stop()
@@ -0,0 +1,52 @@
+import time
+
+import fix_path
+from dynamixel import mirror, servodata, snapshot
+from dynamixel.utils import fakebus
+
+
+def test_sample_time_estimate():
+    bus, uart = fakebus.make_bus([1], 57600, return_delay_us=500)
+    assert bus.sample_time_ns(1) is None
+    before = time.monotonic_ns()
+    bus.read(1, 37, 2)
+    rx_ns, length = bus.rx_times[1]
+    assert length == 13 and rx_ns >= before
+    # 13 bytes at 57600 baud plus the return delay
+    assert bus.reply_delay_ns(13) == 2256944 + 500000
+    assert bus.sample_time_ns(1) == rx_ns - 2756944
+
+
+def test_alignment():
+    old = snapshot.Snapshot(
+        {1: {'pos': 0.0, 'on': True}, 2: {'pos': 10.0, 'on': True}},
+        {1: 0, 2: 5000000}
+    )
+    new = snapshot.Snapshot(
+        {1: {'pos': 1.0, 'on': False}, 2: {'pos': 12.0, 'on': True}},
+        {1: 10000000, 2: 15000000},
+        old
+    )
+    assert new.reference_ns == 15000000
+    assert new.spread_ns == 5000000
+    assert new.rate(1, 'pos') == 100.0
+    assert new.rate(2, 'pos') == 200.0
+    assert new.rate(1, 'on') is None
+    aligned = new.at()
+    assert aligned[1] == {'pos': 1.5, 'on': False}
+    assert aligned[2] == {'pos': 12.0, 'on': True}
+    assert new.at(10000000)[2]['pos'] == 11.0
+    assert old.at() == old.values
+
+
+def test_mirror_snapshot():
+    bus, uart = fakebus.make_bus([1, 2])
+    table = mirror.ControlTableMirror(servodata.get_servo(350), [1, 2])
+    table.refresh(bus, ['Present Position'])
+    first = table.snapshot(['Present Position'])
+    assert first.sample_ns[1] <= first.sample_ns[2]
+    uart.servos[2].write_table(37, [0x64, 0x02])
+    table.refresh(bus, ['Present Position'])
+    second = table.snapshot(['Present Position'], first)
+    assert second.rate(1, 'Present Position') == 0
+    assert second.rate(2, 'Present Position') > 0
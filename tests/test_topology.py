@@ -0,0 +1,48 @@
+import fix_path
+from dynamixel import topology
+from dynamixel.utils import fakebus
+
+PORT = '/dev/ttyUSB0'
+BAUD = 1000000
+
+
+def test_cache_round_trip(tmp_path):
+    path = str(tmp_path / 'cache' / 'topology.json')
+    cache = topology.TopologyCache(path)
+    assert cache.get(PORT, BAUD) is None
+    cache.put(PORT, BAUD, {3: topology.servo_info(350, 0x1F)})
+    assert cache.save()
+
+    loaded = topology.TopologyCache(path)
+    assert loaded.get(PORT, BAUD) == {3: {'model_number': 350, 'firmware': 0x1F}}
+    assert loaded.get(PORT, 57600) is None
+
+
+def test_discover_uses_cache(tmp_path):
+    cache = topology.TopologyCache(str(tmp_path / 'topology.json'))
+    bus, uart = fakebus.make_bus([1, 5])
+
+    servos = topology.discover(bus, PORT, BAUD, cache)
+    assert servos == {
+        1: topology.servo_info(350, 0x1F), 5: topology.servo_info(350, 0x1F)
+    }
+    assert uart.packets_written >= topology.MAX_ADDRESS
+
+    # A known robot is checked with one ping per servo
+    bus, uart = fakebus.make_bus([1, 5])
+    cache = topology.TopologyCache(cache.path)
+    assert topology.discover(bus, PORT, BAUD, cache) == servos
+    assert uart.packets_written == 2
+    assert topology.check(bus, servos, broadcast=True)
+
+    # A servo with new firmware means scanning again
+    uart.servos[5].firmware = 0x20
+    assert not topology.check(bus, servos)
+    servos = topology.discover(bus, PORT, BAUD, cache)
+    assert servos[5]['firmware'] == 0x20
+
+    # So does one that has been added, if a broadcast ping is used
+    uart.add_servo(fakebus.FakeServo(7))
+    assert topology.check(bus, servos)
+    assert not topology.check(bus, servos, broadcast=True)
+    assert set(topology.discover(bus, PORT, BAUD, cache, True)) == {1, 5, 7}
@@ -1,5 +1,6 @@
 import fix_path
-from dynamixel import servo
+from dynamixel import lean, servo, servodata
+from dynamixel.utils import fakebus
 
 def test_hex():
     assert servo.format_data([5], {'type':'hex'}) == '5'
@@ -50,3 +51,30 @@ def test_limits():
 def test_limits_and_offset():
     assert servo.format_data_inverse(5, {'type':'int', 'offset':5, 'max':8}) == [8]
     assert servo.format_data_inverse(5, {'type':'int', 'offset':-5, 'min':2}) == [2]
+
+def test_signed():
+    assert servo.format_data([0xFF, 0xFF], {'type':'int', 'signed':True}) == -1
+    assert servo.format_data([0xFF, 0x7F], {'type':'int', 'signed':True}) == 32767
+    assert servo.format_data([0xFF, 0xFF], {'type':'int'}) == 65535
+    assert servo.format_data([0xF8, 0xFF], {'type':'float', 'scale':0.5, 'signed':True}) == -4.0
+
+def test_signed_inverse():
+    signed = {'type':'int', 'signed':True}
+    assert servo.format_data_inverse(-10, signed) == [0xF6]
+    assert servo.format_data_inverse(128, signed) == [0x80, 0x00]
+    assert servo.encode_value(-10, 4, signed) == [0xF6, 0xFF, 0xFF, 0xFF]
+    assert servo.encode_value(10, 4, signed) == [10, 0, 0, 0]
+    assert servo.encode_value(-2000, 2, dict(signed, min=-885)) == [0x8B, 0xFC]
+    assert servo.format_data(servo.encode_value(-10, 4, signed), signed) == -10
+
+def test_signed_round_trip():
+    bus, uart, (servo_1,) = fakebus.make_servos([1], model_number=1060)
+    assert servo_1.set_homing_offset(-10)
+    assert uart.servos[1].read_table(20, 4) == b'\xf6\xff\xff\xff'
+    assert servo_1.get_homing_offset() == -10
+    assert servo_1.set_goal_velocity(-100)
+    assert servo_1.get_goal_velocity() == -100
+
+    lean_servo = lean.Servo(lean.Protocol2Bus(uart), 1, servodata.get_servo(1060))
+    assert lean_servo.set_goal_pwm(-300)
+    assert lean_servo.get_goal_pwm() == -300
@@ -0,0 +1,53 @@
+import fix_path
+from dynamixel import servo, writebuffer
+from dynamixel.utils import fakebus
+
+
+def test_contiguous_runs():
+    assert writebuffer.contiguous_runs({30: 1, 31: 2, 35: 3, 32: 4}) == [
+        (30, [1, 2, 4]), (35, [3])
+    ]
+
+
+def test_commit_combines_writes():
+    bus, uart, servos = fakebus.make_servos([1, 2, 3])
+    buffer = writebuffer.WriteBuffer(bus)
+    buffer.attach(*servos)
+
+    for serv in servos:
+        assert serv.set_goal_position(0)
+        serv.set_moving_speed(100)
+    servos[0].set_goal_position(29)
+    servos[2].set_led(2)
+    assert uart.packets_written == 0
+    assert len(buffer) == 3
+
+    # Goal Position and Moving Speed are neighbours, so they go in one sync
+    # write to all three servos, followed by the LED write
+    assert buffer.commit() == 2
+    assert uart.servos[1].read_table(30, 4) == bytes([0x64, 0x02, 100, 0])
+    assert uart.servos[2].read_table(30, 4) == bytes([0x00, 0x02, 100, 0])
+    assert uart.servos[3].read_table(25, 1) == bytes([2])
+    assert len(buffer) == 0
+
+    # Different registers on different servos share a bulk write
+    servos[0].set_led(3)
+    servos[1].set_goal_position(0)
+    assert buffer.commit() == 1
+    assert uart.servos[1].read_table(25, 1) == bytes([3])
+    assert buffer.commit() == 0
+
+    # A single leftover write is a normal (acknowledged) write
+    servos[1].set_led(1)
+    assert buffer.commit() == 1
+    assert uart.servos[2].read_table(25, 1) == bytes([1])
+
+    buffer.detach(*servos)
+    packets = uart.packets_written
+    servos[0].set_led(4)
+    assert uart.packets_written == packets + 1
+
+
+def test_encode_value():
+    assert servo.encode_value(2048, 4, {'type': 'int'}) == [0, 8, 0, 0]
+    assert servo.encode_value(5, 2, {'type': 'int'}) == [5, 0]